@@ -4,41 +4,111 @@
 Flask Web服务器 - 微博内容爬取工具
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
-import threading
-import queue
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory
 import os
 import json
 import time
-from web_scraper import scrape_weibo_web
+import uuid
+from urllib.parse import quote
+from web_scraper import scrape_key, scrape_weibo_web
+from image_derivatives import get_shared_derivatives
+from image_store import is_blob_name
+from packager import LivePackage, build_package, stream_package
+from task_executor import SingleFlight, TaskExecutor, TaskRejected
+from task_store import BatchedProgressWriter, ProgressHub, create_task_store
+from result_cache import ResultCache
+import mimetypes
+import shutil
+import threading
 import traceback
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 
 app = Flask(__name__)
 app.secret_key = 'weibo_scraper_secret_key_2025'
 
-# 全局变量存储任务状态
-task_status = {}
-task_results = {}
+# 下载目录；WEIBO_SENDFILE=x-accel 时交给前置nginx发送文件（内部location见 WEB_DEPLOYMENT.md），
+# =x-sendfile 时交给 Apache mod_xsendfile / lighttpd，Flask工作线程不再传输文件内容
+OUTPUT_DIR = 'weibo_output'
+SENDFILE_MODE = os.environ.get('WEIBO_SENDFILE', '').lower()
+ACCEL_PREFIX = os.environ.get('WEIBO_ACCEL_PREFIX', '/protected/weibo_output/')
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+
+# 爬取任务执行器：同时爬取的任务数、等待队列长度、每个客户端同时进行的任务数
+task_executor = TaskExecutor(
+    max_workers=int(os.environ.get('WEIBO_TASK_WORKERS', 2)),
+    max_queue=int(os.environ.get('WEIBO_TASK_QUEUE', 20)),
+    max_per_client=int(os.environ.get('WEIBO_TASKS_PER_CLIENT', 2))
+)
+# 结果缓存：参数相同的请求在 WEIBO_RESULT_CACHE_TTL 秒内直接返回已生成的结果（0 为不缓存），
+# 报告文件总大小不超过 WEIBO_RESULT_CACHE_MB；缓存项移除后释放它引用的任务工作区
+result_cache = ResultCache(
+    os.path.join(OUTPUT_DIR, 'data', 'result_cache.sqlite3'),
+    ttl=int(os.environ.get('WEIBO_RESULT_CACHE_TTL', 600)),
+    max_bytes=int(float(os.environ.get('WEIBO_RESULT_CACHE_MB', 1024)) * 1024 * 1024),
+    on_release=lambda files: release_cached_files(files)
+)
+# 参数相同的进行中任务只执行一次，后来的请求共用同一任务的进度和结果（按进程合并）
+inflight_tasks = SingleFlight()
+# 部署在反向代理之后时设为代理的层数，按 X-Forwarded-For 中最后这几层代理添加的地址区分客户端
+# （更靠左的条目由客户端自己填写，不可信）
+TRUSTED_PROXIES = int(os.environ.get('WEIBO_TRUST_PROXY') or 0)
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# 任务存储：WEIBO_TASK_STORE=sqlite:<路径> 时多个worker进程共享任务状态；
+# 已结束的任务保留 WEIBO_TASK_TTL 秒
+task_store = create_task_store(
+    os.environ.get('WEIBO_TASK_STORE', 'memory'),
+    ttl=int(os.environ.get('WEIBO_TASK_TTL', 3600))
+)
+# 本进程执行的任务的进度通知（SSE推送）；SSE心跳间隔，以及订阅其他进程的任务时读取存储的间隔
+progress_hub = ProgressHub()
+SSE_HEARTBEAT_SECONDS = 15
+SSE_STORE_POLL_SECONDS = 2
+# 每个任务的工作区（报告、图片清单、压缩包），图片只通过共享的内容寻址图片库读取
+TASKS_DIR = os.path.join(OUTPUT_DIR, 'tasks')
+# 本进程正在执行的任务的流式压缩包（任务结束后从任务存储读取清单）
+task_packages = {}
+# 工作区引用计数的检查与删除、使用缓存结果创建任务，两者互斥
+workspace_lock = threading.RLock()
+# 已完成任务的压缩包文件 -> 生成锁（同一个压缩包只生成一次）
+package_build_locks = {}
 
 class ProgressTracker:
-    """进度跟踪器"""
+    """进度跟踪器，进度写入任务存储（合并高频更新）"""
     def __init__(self, task_id):
         self.task_id = task_id
         self.progress = 0
         self.status = "初始化中..."
+        self.writer = BatchedProgressWriter(task_store, task_id)
     
     def update(self, progress, status):
         self.progress = progress
         self.status = status
-        task_status[self.task_id] = {
+        # 爬取阶段的100%不代表任务完成，报告生成后由 finish() 标记完成
+        update = {
             'progress': progress,
             'status': status,
-            'completed': progress >= 100
+            'completed': False
         }
+        progress_hub.publish(self.task_id, update)
+        self.writer.write(update)
+    
+    def finish(self, result):
+        """写入最终状态和结果"""
+        self.writer.discard()
+        if result['success']:
+            status = {'progress': 100, 'status': "爬取完成！", 'completed': True}
+        else:
+            status = {'progress': 0, 'status': f"爬取失败: {result['error']}", 'completed': True}
+        task_store.finish(self.task_id, status, result)
+        progress_hub.publish(self.task_id, status)
 
-def background_scrape(task_id, params):
+def background_scrape(task_id, params, key=None):
     """后台爬取任务"""
     progress_tracker = ProgressTracker(task_id)
+    package = task_packages.get(task_id)
     
     try:
         # 更新进度回调函数
@@ -47,15 +117,25 @@ def background_scrape(task_id, params):
         
         # 执行爬取
         progress_tracker.update(5, "开始爬取微博内容...")
-        result = scrape_weibo_web(params, progress_callback)
+        result = scrape_weibo_web(params, progress_callback, package=package, workspace_dir=task_workspace(task_id))
+        result['package_url'] = f"/package/{task_id}"
+        
+        # 保存压缩包清单，其他worker进程也能提供下载
+        if package is not None:
+            task_store.set_package(task_id, package.name, package.members())
+        
+        # 缓存结果，有效期内参数相同的请求直接返回
+        if key is not None:
+            result_cache.put(
+                key, result, (package.name, package.members()) if package is not None else None,
+                [result['markdown_file'], result['html_file'], result['manifest_file']]
+            )
         
         # 保存结果
-        task_results[task_id] = {
+        progress_tracker.finish({
             'success': True,
             'data': result
-        }
-        
-        progress_tracker.update(100, "爬取完成！")
+        })
         
     except Exception as e:
         # 错误处理
@@ -63,18 +143,78 @@ def background_scrape(task_id, params):
         print(f"爬取失败: {error_msg}")
         print(traceback.format_exc())
         
-        task_results[task_id] = {
+        # 结束正在进行的流式下载
+        if package is not None:
+            package.close(error_msg)
+        
+        progress_tracker.finish({
             'success': False,
             'error': error_msg
-        }
-        
-        progress_tracker.update(0, f"爬取失败: {error_msg}")
+        })
+    
+    finally:
+        # 已开始的下载继续使用原对象，之后的下载按任务存储中的清单打包
+        task_packages.pop(task_id, None)
+        progress_hub.discard(task_id)
+        if key is not None:
+            inflight_tasks.release(key, task_id)
+
+def client_id():
+    """发起请求的客户端（用于限制每个客户端的任务数），经过可信代理时由 ProxyFix 还原"""
+    return request.remote_addr or 'unknown'
 
 @app.route('/')
 def index():
     """主页"""
     return render_template('index.html')
 
+def task_workspace(task_id):
+    """任务的工作区目录"""
+    return os.path.join(TASKS_DIR, task_id)
+
+def workspace_of(path):
+    """文件所在的任务工作区，不在任务工作区内时返回 None"""
+    relative = os.path.relpath(path, TASKS_DIR)
+    if relative.startswith(os.pardir):
+        return None
+    return task_workspace(relative.split(os.sep)[0])
+
+def release_workspace(workspace):
+    """工作区的引用数（指向它的任务 + 使用其文件的缓存项）为0时删除工作区"""
+    with workspace_lock:
+        if task_store.workspace_refs(workspace) or result_cache.refs(workspace):
+            return
+        if os.path.isdir(workspace):
+            shutil.rmtree(workspace, ignore_errors=True)
+
+def release_cached_files(signatures):
+    """缓存项移除后释放它的文件所在的工作区"""
+    for workspace in {workspace_of(signature[0]) for signature in signatures} - {None}:
+        release_workspace(workspace)
+
+def evict_expired_tasks():
+    """清除过期的已结束任务，释放它们指向的工作区（仍被其他任务或结果缓存引用的保留）"""
+    for workspace in set(task_store.evict_expired()) - {None}:
+        release_workspace(workspace)
+
+def create_cached_task(task_id, result, package):
+    """用缓存的结果创建一个已完成的任务，进度和下载接口与普通任务相同；任务指向原任务的工作区"""
+    result = dict(result, package_url=f"/package/{task_id}")
+    task_store.create(task_id, {'progress': 100, 'status': '完成', 'completed': True},
+                      workspace=workspace_of(result['markdown_file']))
+    if package[0] is not None:
+        task_store.set_package(task_id, *package)
+    task_store.finish(task_id, {'progress': 100, 'status': "使用缓存的结果", 'completed': True}, {
+        'success': True,
+        'data': result
+    })
+    return {
+        'task_id': task_id,
+        'package_url': result['package_url'],
+        'cached': True,
+        'message': '已有相同参数的结果，直接返回'
+    }
+
 @app.route('/scrape', methods=['POST'])
 def start_scrape():
     """开始爬取任务"""
@@ -88,81 +228,254 @@ def start_scrape():
             if not params.get(field):
                 return jsonify({'error': f'缺少必要参数: {field}'}), 400
         
-        # 生成任务ID
-        task_id = f"task_{int(time.time() * 1000)}"
+        # 顺带清除过期的已结束任务
+        evict_expired_tasks()
+        
+        # 生成任务ID（多个worker进程同时创建任务也不会重复）
+        task_id = f"task_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
         
-        # 初始化任务状态
-        task_status[task_id] = {
+        key = scrape_key(params)
+        
+        # 有效期内已有相同参数的结果时直接返回（refresh 为真时重新爬取）
+        # 取缓存和创建任务之间工作区不能被释放
+        with workspace_lock:
+            cached = None if params.get('refresh') else result_cache.get(key)
+            if cached is not None:
+                return jsonify(create_cached_task(task_id, *cached))
+        
+        # 初始化任务状态（先于登记进行中任务，加入该任务的请求查询进度时任务已存在）
+        task_store.create(task_id, {
             'progress': 0,
             'status': '任务已创建，等待开始...',
             'completed': False
-        }
+        }, workspace=task_workspace(task_id))
+        
+        # 已有参数相同的任务在排队或执行时，直接加入该任务
+        running_task_id = inflight_tasks.claim(key, task_id)
+        if running_task_id != task_id:
+            task_store.delete(task_id)
+            return jsonify({
+                'task_id': running_task_id,
+                'package_url': f"/package/{running_task_id}",
+                'queue_position': task_executor.position(running_task_id),
+                'coalesced': True,
+                'message': '相同的任务正在进行，已加入该任务...'
+            })
         
-        # 启动后台任务
-        thread = threading.Thread(
-            target=background_scrape,
-            args=(task_id, params)
-        )
-        thread.daemon = True
-        thread.start()
+        # 压缩包在下载时流式生成，任务进行中即可开始下载
+        task_packages[task_id] = LivePackage()
+        
+        # 交给有界执行器；队列已满或该客户端任务过多时返回429
+        try:
+            position = task_executor.submit(task_id, client_id(), background_scrape, task_id, params, key)
+        except TaskRejected as e:
+            inflight_tasks.release(key, task_id)
+            task_store.delete(task_id)
+            task_packages.pop(task_id, None)
+            response = jsonify({'error': f"{e}（约 {e.retry_after} 秒后重试）", 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
         
         return jsonify({
             'task_id': task_id,
+            'package_url': f"/package/{task_id}",
+            'queue_position': position,
             'message': '任务已启动，正在后台处理...'
         })
         
     except Exception as e:
         return jsonify({'error': f'启动任务失败: {str(e)}'}), 500
 
-@app.route('/progress/<task_id>')
-def get_progress(task_id):
-    """获取任务进度"""
-    if task_id not in task_status:
-        return jsonify({'error': '任务不存在'}), 404
+def progress_payload(task_id):
+    """任务进度（完成时附带结果），任务不存在时返回 None"""
+    task = task_store.get(task_id)
+    if task is None:
+        return None
     
-    status = task_status[task_id]
+    status = task['status']
     
     # 如果任务完成，返回结果
-    if status['completed'] and task_id in task_results:
-        result = task_results[task_id]
+    if status['completed'] and task['result'] is not None:
+        result = task['result']
         if result['success']:
-            return jsonify({
+            return {
                 'progress': 100,
                 'status': '完成',
                 'completed': True,
                 'result': result['data']
-            })
+            }
         else:
-            return jsonify({
+            return {
                 'progress': 0,
                 'status': f"失败: {result['error']}",
                 'completed': True,
                 'error': result['error']
-            })
+            }
+    
+    # 本进程执行的任务使用最新进度（存储中的进度是合并写入的）
+    latest = progress_hub.latest(task_id)
+    if latest is not None and not latest[1]['completed']:
+        status = latest[1]
+    
+    # 排队中的任务返回排队位置
+    position = task_executor.position(task_id)
+    if position:
+        status = dict(status, queue_position=position, status=f"排队中，前面还有 {position - 1} 个任务...")
     
-    return jsonify(status)
+    return status
+
+@app.route('/progress/<task_id>')
+def get_progress(task_id):
+    """获取任务进度"""
+    payload = progress_payload(task_id)
+    if payload is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(payload)
+
+def progress_events(task_id):
+    """SSE事件流：进度变化时立即推送，空闲时发送心跳，任务结束后关闭"""
+    version = 0
+    last_sent = None
+    idle = 0
+    while True:
+        payload = progress_payload(task_id)
+        if payload is None:
+            yield f"event: gone\ndata: {json.dumps({'error': '任务不存在'}, ensure_ascii=False)}\n\n"
+            return
+        
+        data = json.dumps(payload, ensure_ascii=False)
+        if data != last_sent:
+            yield f"data: {data}\n\n"
+            last_sent = data
+            idle = 0
+        elif idle >= SSE_HEARTBEAT_SECONDS:
+            yield ": heartbeat\n\n"
+            idle = 0
+        
+        if payload['completed']:
+            return
+        
+        # 本进程执行的任务等待通知；其他进程的任务（或仍在排队）定期读取存储
+        started = time.time()
+        current = progress_hub.wait(task_id, version, SSE_HEARTBEAT_SECONDS)
+        if current is None:
+            time.sleep(SSE_STORE_POLL_SECONDS)
+        else:
+            version = current
+        idle += time.time() - started
+
+@app.route('/progress/<task_id>/stream')
+def stream_progress(task_id):
+    """以Server-Sent Events推送任务进度"""
+    if task_store.get(task_id) is None:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    response = Response(progress_events(task_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def attachment_header(filename):
+    """Content-Disposition（文件名可含中文）"""
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def accel_redirect(relative):
+    """让nginx通过内部location发送 weibo_output 下的文件（nginx自行处理Range和ETag）"""
+    response = Response(mimetype=mimetypes.guess_type(relative)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = ACCEL_PREFIX + quote(relative)
+    response.headers['Content-Disposition'] = attachment_header(os.path.basename(relative))
+    return response
 
 @app.route('/download/<path:filename>')
 def download_file(filename):
-    """文件下载"""
+    """文件下载：支持ETag/Last-Modified重新验证和Range断点续传"""
     try:
-        # 安全检查：只允许下载特定目录下的文件
-        if not filename.startswith(('weibo_output/reports/', 'weibo_output/images.zip', 'weibo_output/')):
+        # 安全检查：只允许下载 weibo_output 下的文件（拒绝 ../ 跳出目录）
+        prefix = f"{OUTPUT_DIR}/"
+        relative = filename[len(prefix):] if filename.startswith(prefix) else None
+        if not relative or safe_join(OUTPUT_DIR, relative) is None:
             return jsonify({'error': '不允许下载该文件'}), 403
         
         # 检查文件是否存在
-        if not os.path.exists(filename):
+        if not os.path.isfile(safe_join(OUTPUT_DIR, relative)):
             return jsonify({'error': '文件不存在'}), 404
         
-        # 获取文件目录和文件名
-        directory = os.path.dirname(filename)
-        basename = os.path.basename(filename)
-        
-        return send_from_directory(directory, basename, as_attachment=True)
+        return send_output_file(relative)
         
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
+def send_output_file(relative):
+    """发送 weibo_output 下的文件，支持ETag/Last-Modified和Range，可交给nginx发送"""
+    if SENDFILE_MODE == 'x-accel':
+        return accel_redirect(relative)
+    
+    # 同名报告会被重新生成，每次都用ETag/Last-Modified重新验证（未变化时返回304）
+    return send_from_directory(
+        OUTPUT_DIR, relative, as_attachment=True, conditional=True, etag=True, max_age=0
+    )
+
+def finished_package_file(task_id, filename, members):
+    """已完成任务的压缩包文件（在任务工作区中生成一次，之后直接复用），无法生成时返回 None"""
+    task = task_store.get(task_id)
+    result = task['result'] if task else None
+    workspace = result['data'].get('workspace') if result and result.get('success') else None
+    if not workspace or not filename:
+        return None
+    
+    zip_path = os.path.join(workspace, filename)
+    with workspace_lock:
+        build_lock = package_build_locks.setdefault(zip_path, threading.Lock())
+    with build_lock:
+        if not os.path.isfile(zip_path):
+            try:
+                build_package(zip_path, members)
+            except OSError as e:
+                print(f"⚠️ 生成压缩包失败，改为流式发送: {zip_path} - {e}")
+                return None
+    with workspace_lock:
+        package_build_locks.pop(zip_path, None)
+    return zip_path
+
+@app.route('/package/<task_id>')
+def download_package(task_id):
+    """下载任务的完整压缩包
+
+    任务进行中时边打包边发送（不落盘），随图片下载进度发送；任务完成后按保存的清单生成一次压缩包文件，
+    与 /download/ 一样支持ETag重新验证和Range断点续传。
+    """
+    package = task_packages.get(task_id)
+    if package is not None:
+        filename, members = package.name, package
+    else:
+        saved = task_store.get_package(task_id)
+        if saved is None:
+            return jsonify({'error': '任务不存在或尚未完成'}), 404
+        filename, members = saved
+        
+        zip_path = finished_package_file(task_id, filename, members)
+        if zip_path is not None:
+            return send_output_file(os.path.relpath(zip_path, OUTPUT_DIR).replace(os.sep, '/'))
+    
+    response = Response(stream_package(members), mimetype='application/zip')
+    response.headers['Content-Disposition'] = attachment_header(filename or f"{task_id}.zip")
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/images/<path:blob>')
+def serve_image(blob):
+    """图片库中的图片，默认返回限宽的显示图，?original=1 返回原图"""
+    images_dir = os.path.join('weibo_output', 'images')
+    # 只接受图片库的图片名，在生成显示图之前拒绝其他路径
+    if not is_blob_name(blob) or not os.path.isfile(os.path.join(images_dir, blob)):
+        return jsonify({'error': '图片不存在'}), 404
+    
+    name = blob
+    if request.args.get('original') != '1':
+        name = get_shared_derivatives(images_dir).display_name(blob) or blob
+    # 图片按内容哈希命名，内容不会变化，可以长期缓存
+    return send_from_directory(images_dir, name, max_age=31536000)
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """静态文件服务"""
@@ -174,7 +487,8 @@ def api_test():
     return jsonify({
         'status': 'ok',
         'message': '微博爬虫API正常运行',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'tasks': dict(task_executor.get_stats(), inflight=len(inflight_tasks))
     })
 
 @app.errorhandler(404)
@@ -198,6 +512,8 @@ def ensure_directories():
             os.makedirs('weibo_output/reports')
         if not os.path.exists('weibo_output/images'):
             os.makedirs('weibo_output/images')
+        if not os.path.exists(TASKS_DIR):
+            os.makedirs(TASKS_DIR)
     except Exception as e:
         print(f"Warning: Could not create directories: {e}")
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+报告生成基准测试 - 用合成数据测量Markdown/HTML报告的耗时和峰值内存
+使用方法：python3 benchmark_report.py [微博条数，默认50000]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from web_scraper import WebWeiboScraper
+
+
+def make_images(scraper, count=20, size=30 * 1024):
+    """生成若干张合成图片并存入图片库，返回 [(链接, 路径)]"""
+    images = []
+    for n in range(count):
+        tmp_path = scraper.image_store.temp_path()
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe0' + bytes([n]) * size)
+        url = f"https://wx1.sinaimg.cn/large/bench_{n}.jpg"
+        images.append((url, scraper.image_store.ingest(tmp_path, url)))
+    return images
+
+
+def make_weibos(scraper, count, images):
+    """生成合成微博；每10条中有1条带图片，每5条中有1条是转发"""
+    weibos = []
+    for i in range(count):
+        weibo_id = str(5000000000000000 + i)
+        weibo = {
+            'id': weibo_id,
+            'mid': weibo_id,
+            'created_at': 'Mon Sep 01 12:00:00 +0800 2025',
+            'text': f"第{i}条合成微博，" + "用于测量报告生成的耗时和内存。" * 10,
+            'source': 'iPhone客户端',
+            'reposts_count': i % 1000,
+            'comments_count': i % 500,
+            'attitudes_count': i % 2000,
+            'url': f"https://m.weibo.cn/detail/{weibo_id}",
+        }
+        if i % 5 == 0:
+            weibo['retweeted'] = {'user_name': '原作者', 'text': '被转发的内容。' * 20}
+        if i % 10 == 0:
+            for index in range(1, 4):
+                url, path = images[(i + index) % len(images)]
+                info = scraper.image_store.describe(url)
+                scraper.image_manifest.record(weibo_id, index, False, info['blob'], info['size'], info['mime'], url)
+        weibos.append(weibo)
+    return weibos
+
+
+def measure(label, func, *args):
+    """执行一次并打印耗时和峰值内存"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<12} 耗时 {elapsed:7.2f} 秒，峰值内存 {peak / 1024 / 1024:7.1f} MB")
+
+
+def main():
+    post_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    output_dir = tempfile.mkdtemp(prefix="weibo_bench_")
+
+    try:
+        # 合成的图片不是有效的图片文件，报告直接引用原图，不生成显示图
+        scraper = WebWeiboScraper('0', 'benchmark', '2025-01-01', '2025-12-31', output_dir=output_dir,
+                                  report_image_size='original')
+        images = make_images(scraper)
+
+        for count in sorted({post_count // 10, post_count}):
+            scraper.image_manifest = type(scraper.image_manifest)()
+            weibos = make_weibos(scraper, count, images)
+            md_filename = os.path.join(scraper.reports_dir, f"bench_{count}.md")
+            html_filename = os.path.join(scraper.reports_dir, f"bench_{count}.html")
+
+            print(f"📊 {count} 条微博，{scraper.image_count()} 张图片")
+            measure("Markdown", scraper.generate_markdown_report, weibos, md_filename)
+            for mode in ('embed', 'linked'):
+                scraper.report_image_mode = mode
+                measure(f"HTML/{mode}", scraper.generate_html_report, weibos, html_filename, md_filename)
+                print(f"  HTML大小 {os.path.getsize(html_filename) / 1024 / 1024:.1f} MB")
+    finally:
+        scraper.image_pool.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
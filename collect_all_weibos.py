@@ -4,18 +4,21 @@
 搜集指定时间范围内的所有微博 - 基于可工作的报告生成器扩展
 """
 
-import ssl
-import urllib.request
 import json
 import re
 import os
 import glob
 from datetime import datetime
 import codecs
-import time
+from http_client import get_shared_client
+from text_cache import get_shared_text_cache, hit_ratio
 from config import WEIBO_USER_ID, USER_NAME, OUTPUT_DIR, START_DATE, END_DATE
 
 
+# 单张图片的字节上限，超过时放弃下载
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+
 def format_chinese_date(date_str):
     """将日期转换为中文格式"""
     try:
@@ -76,15 +79,8 @@ def download_image(image_url, weibo_id, image_index, images_dir):
             'Referer': 'https://m.weibo.cn/',
         }
         
-        req = urllib.request.Request(image_url, headers=headers)
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        response = urllib.request.urlopen(req, timeout=15, context=ssl_context)
-        
-        with open(filepath, 'wb') as f:
-            f.write(response.read())
+        # 分块写入临时文件后改名，中断时不会留下半截图片（下次运行不会误当作已下载）
+        get_shared_client().download(image_url, filepath, headers=headers, timeout=15, max_bytes=MAX_IMAGE_BYTES)
         
         print(f"✅ 下载图片: {filename}")
         return filepath
@@ -96,9 +92,9 @@ def download_image(image_url, weibo_id, image_index, images_dir):
 
 def collect_all_weibos():
     """搜集所有微博"""
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
+    http = get_shared_client()
+    text_cache = get_shared_text_cache(os.path.join(OUTPUT_DIR, "data", "long_text_cache.sqlite3"))
+    cache_stats = {}
     
     headers = {
         'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15',
@@ -126,15 +122,19 @@ def collect_all_weibos():
     
     def get_full_text(weibo_id):
         """获取微博全文"""
+        cached = text_cache.get(weibo_id, cache_stats)
+        if cached is not None:
+            return clean_html(cached)
+        
         full_text_url = f"https://m.weibo.cn/statuses/extend?id={weibo_id}"
         try:
-            req = urllib.request.Request(full_text_url, headers=headers)
-            response = urllib.request.urlopen(req, timeout=15, context=ssl_context)
+            response = http.get(full_text_url, headers=headers, timeout=15)
             content = response.read().decode('utf-8')
             data = json.loads(content)
             if data.get('ok') == 1:
                 full_text = data.get('data', {}).get('longTextContent', '')
                 if full_text:
+                    text_cache.put(weibo_id, full_text)
                     return clean_html(full_text)
         except Exception as e:
             print(f"获取全文失败: {e}")
@@ -149,19 +149,19 @@ def collect_all_weibos():
     print(f"📅 时间范围: {START_DATE} 到 {END_DATE}")
     
     while page <= max_pages:
-        print(f"\n📖 正在获取第 {page} 页...")
+        print(f"\n📖 正在获取第 {page} 页...（当前速率 {http.get_rate('https://m.weibo.cn/') or 0:.2f} 次/秒）")
         
         # 获取微博列表
         url = f"https://m.weibo.cn/api/container/getIndex?type=uid&value={WEIBO_USER_ID}&containerid=107603{WEIBO_USER_ID}&page={page}"
         
         try:
-            req = urllib.request.Request(url, headers=headers)
-            response = urllib.request.urlopen(req, timeout=30, context=ssl_context)
+            response = http.get(url, headers=headers, timeout=30)
             content = response.read().decode('utf-8')
             data = json.loads(content)
             
             if data.get('ok') != 1:
                 print(f"❌ 第 {page} 页获取失败")
+                http.report_throttle(url)
                 break
             
             cards = data.get('data', {}).get('cards', [])
@@ -251,13 +251,16 @@ def collect_all_weibos():
                 break
             
             page += 1
-            time.sleep(2)  # 请求间隔
+            # 请求间隔由共享限速器控制
             
         except Exception as e:
             print(f"❌ 第 {page} 页获取失败: {e}")
             break
     
     print(f"\n🎉 搜集完成！总共获取到 {len(all_weibos)} 条微博")
+    http_stats = http.get_stats()
+    print(f"🔌 连接复用: {http_stats['pool_hits']} 次，新建连接: {http_stats['pool_misses']} 次")
+    print(f"📚 全文缓存命中率: {hit_ratio(cache_stats):.0%}（命中 {cache_stats.get('text_cache_hits', 0)} 次）")
     return all_weibos
 
 
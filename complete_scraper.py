@@ -4,28 +4,30 @@
 完整版微博爬虫 - 包含全文、图片下载、微博链接
 """
 
-import ssl
-import urllib.request
-import urllib.parse
 import json
 import re
 import os
 import hashlib
 from datetime import datetime, timedelta
 import codecs
+from http_client import ACCEPT_ENCODING, get_shared_client
+from text_cache import get_shared_text_cache, hit_ratio
+from image_store import IMAGE_QUALITIES, select_pic_url
 
 
 class CompleteWeiboScraper:
-    def __init__(self):
-        # SSL设置
-        self.ssl_context = ssl.create_default_context()
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_NONE
+    def __init__(self, image_quality="large"):
+        # 共享HTTP客户端（按主机复用keep-alive连接）
+        self.http = get_shared_client()
+        
+        # 图片清晰度（thumbnail/bmiddle/large，none 为不下载图片）
+        self.image_quality = image_quality if image_quality in IMAGE_QUALITIES else 'large'
         
         self.uid = "1317335037"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
             'Accept': 'application/json, text/plain, */*',
+            'Accept-Encoding': ACCEPT_ENCODING,
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Referer': f'https://m.weibo.cn/u/{self.uid}',
             'Connection': 'keep-alive',
@@ -35,6 +37,10 @@ class CompleteWeiboScraper:
         self.images_dir = "weibo_images"
         if not os.path.exists(self.images_dir):
             os.makedirs(self.images_dir)
+        
+        # 全文缓存（跨任务持久化）
+        self.text_cache = get_shared_text_cache()
+        self.cache_stats = {'text_cache_hits': 0, 'text_cache_misses': 0}
 
     def decode_text_properly(self, text):
         """正确解码Unicode文本"""
@@ -91,8 +97,7 @@ class CompleteWeiboScraper:
         """发送HTTP请求"""
         for attempt in range(max_retries):
             try:
-                req = urllib.request.Request(url, headers=self.headers)
-                response = urllib.request.urlopen(req, timeout=30, context=self.ssl_context)
+                response = self.http.get(url, headers=self.headers, timeout=30)
                 
                 content_bytes = response.read()
                 try:
@@ -106,14 +111,18 @@ class CompleteWeiboScraper:
                 return content
                 
             except Exception as e:
+                # 失败后降低该主机速率，下次重试由限速器决定等待时间
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2)
+                    self.http.report_throttle(url)
                     
         return None
 
     def get_full_text(self, weibo_id):
         """获取微博全文"""
+        cached = self.text_cache.get(weibo_id, self.cache_stats)
+        if cached is not None:
+            return self.clean_html_and_decode(cached)
+        
         full_text_url = f"https://m.weibo.cn/statuses/extend?id={weibo_id}"
         
         try:
@@ -123,7 +132,10 @@ class CompleteWeiboScraper:
                 if data.get('ok') == 1:
                     full_text = data.get('data', {}).get('longTextContent', '')
                     if full_text:
+                        self.text_cache.put(weibo_id, full_text)
                         return self.clean_html_and_decode(full_text)
+                else:
+                    self.http.report_throttle(full_text_url)
         except Exception as e:
             print(f"  获取全文失败: {e}")
         
@@ -144,16 +156,11 @@ class CompleteWeiboScraper:
             if os.path.exists(filepath):
                 return filename
             
-            # 下载图片
-            req = urllib.request.Request(image_url, headers={
+            # 分块写入临时文件后改名，中断时不会留下半截图片
+            self.http.download(image_url, filepath, headers={
                 'User-Agent': self.headers['User-Agent'],
                 'Referer': 'https://weibo.com/'
-            })
-            
-            response = urllib.request.urlopen(req, timeout=30, context=self.ssl_context)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.read())
+            }, timeout=30)
             
             print(f"    ✅ 下载图片: {filename}")
             return filename
@@ -251,7 +258,7 @@ class CompleteWeiboScraper:
                 print(f"    🖼️ 发现 {len(mblog['pics'])} 张图片，开始下载...")
                 weibo['images'] = []
                 for idx, pic in enumerate(mblog['pics'], 1):
-                    pic_url = pic.get('large', {}).get('url', '') or pic.get('url', '')
+                    pic_url = select_pic_url(pic, self.image_quality)
                     if pic_url:
                         # 下载图片
                         local_filename = self.download_image(pic_url, weibo_id, idx)
@@ -286,7 +293,7 @@ class CompleteWeiboScraper:
                         weibo['images'] = []
                     
                     for idx, pic in enumerate(rt['pics'], len(weibo.get('images', [])) + 1):
-                        pic_url = pic.get('large', {}).get('url', '') or pic.get('url', '')
+                        pic_url = select_pic_url(pic, self.image_quality)
                         if pic_url:
                             local_filename = self.download_image(pic_url, f"{weibo_id}_rt", idx)
                             weibo['images'].append({
@@ -309,7 +316,7 @@ class CompleteWeiboScraper:
         print(f"🔍 开始爬取用户 {self.uid} 的完整微博内容...")
         
         for page in range(1, 11):  # 先爬10页测试
-            print(f"\n📄 爬取第 {page} 页...")
+            print(f"\n📄 爬取第 {page} 页...（当前速率 {self.http.get_rate('https://m.weibo.cn/') or 0:.2f} 次/秒）")
             
             url = f"https://m.weibo.cn/api/container/getIndex?type=uid&value={self.uid}&containerid={container_id}&page={page}"
             
@@ -323,6 +330,7 @@ class CompleteWeiboScraper:
                 
                 if data.get('ok') != 1:
                     print(f"❌ API错误: {data.get('msg', '未知')}")
+                    self.http.report_throttle(url)
                     break
                 
                 cards = data.get('data', {}).get('cards', [])
@@ -348,8 +356,7 @@ class CompleteWeiboScraper:
                 else:
                     print(f"⚠️ 第 {page} 页无目标微博")
                 
-                import time
-                time.sleep(3)  # 页面间延迟
+                # 页面间隔由共享限速器控制，不再固定等待
                 
             except Exception as e:
                 print(f"❌ 处理第 {page} 页失败: {e}")
@@ -464,6 +471,10 @@ class CompleteWeiboScraper:
             print(f"📄 文档文件: {filename}")
             print(f"📊 微博数量: {len(weibos)} 条")
             print(f"🖼️ 图片下载: {total_images} 张")
+            http_stats = self.http.get_stats()
+            print(f"🔌 连接复用: {http_stats['pool_hits']} 次，新建连接: {http_stats['pool_misses']} 次")
+            print(f"🗜️ 传输流量: {http_stats['wire_bytes'] / 1024:.0f} KB，解压后: {http_stats['decoded_bytes'] / 1024:.0f} KB")
+            print(f"📚 全文缓存命中率: {hit_ratio(self.cache_stats):.0%}（命中 {self.cache_stats['text_cache_hits']} 次）")
             print(f"📁 图片目录: {self.images_dir}/")
             
             return {
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio爬取引擎 - 让页面请求、全文请求和图片下载在并发上限内重叠执行
+"""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncCrawlEngine:
+    """驱动 WebWeiboScraper 的异步爬取流程
+
+    HTTP请求仍由共享的阻塞客户端完成，在线程池中执行；全文请求受信号量限制，
+    图片交给爬虫的下载池，由下载池自身的线程数和队列长度限制。
+    """
+    def __init__(self, scraper, text_concurrency=4, max_search_page=1024):
+        self.scraper = scraper
+        self.text_concurrency = max(1, text_concurrency)
+        self.max_search_page = max_search_page
+
+        self._executor = None
+        self._text_semaphore = None
+        self._pages = {}
+
+    async def _call(self, func, *args):
+        """在线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def fetch_page(self, page):
+        """获取一页微博列表，返回解析后的JSON"""
+        url = self.scraper.build_page_url(page)
+        response = await self._call(self.scraper.fetch, url, 30)
+        data = json.loads(response.read().decode('utf-8'))
+        if data.get('ok') != 1:
+            self.scraper.http.report_throttle(url)
+        return data
+
+    async def load_page(self, page):
+        """获取一页，定位时间窗口时已取过的页直接复用"""
+        if page not in self._pages:
+            self._pages[page] = await self.fetch_page(page)
+        return self._pages[page]
+
+    async def prefetch_page(self, page):
+        """预取下一页（由限速器控制发出时机），与当前页的处理重叠"""
+        if page not in self._pages:
+            print(f"⏩ 预取第 {page} 页...")
+        return await self.load_page(page)
+
+    @staticmethod
+    def _discard(task):
+        """丢弃不再需要的预取任务"""
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # 取走异常，避免未处理异常警告
+
+    async def fetch_full_text(self, weibo_id):
+        """受并发上限约束地获取全文"""
+        async with self._text_semaphore:
+            print(f"📝 获取微博 {weibo_id} 的全文...")
+            return await self._call(self.scraper.get_full_text, weibo_id)
+
+    async def queue_images(self, mblog):
+        """把微博图片排入下载池（队列满时在线程中等待，不阻塞事件循环）"""
+        for image_url, weibo_id, image_index in self.scraper.iter_image_jobs(mblog):
+            await self._call(self.scraper.queue_image, image_url, weibo_id, image_index)
+
+    async def resolve_text(self, mblog):
+        """清理文本，需要时获取全文"""
+        text = self.scraper.clean_html(mblog.get('text', ''))
+        if self.scraper.needs_full_text(mblog, text):
+            full_text = await self.fetch_full_text(mblog.get('id', ''))
+            if full_text:
+                print(f"✅ 全文获取成功: {len(full_text)} 字符")
+                return full_text
+        return text
+
+    async def process_mblog(self, mblog):
+        """处理单条微博：时间筛选、全文、关键词筛选，并排队下载图片"""
+        scraper = self.scraper
+        scraper.stats['total_weibos'] += 1
+        scraper.observe_mblog(mblog)
+
+        if not scraper.is_in_date_range(mblog.get('created_at', '')):
+            return None
+
+        # 正文和转发内容的全文请求并行发出
+        rt = mblog.get('retweeted_status')
+        if rt:
+            text, rt_text = await asyncio.gather(self.resolve_text(mblog), self.resolve_text(rt))
+        else:
+            text, rt_text = await self.resolve_text(mblog), None
+
+        weibo_data = scraper.build_weibo_data(mblog, text, rt_text)
+        scraper.archive_record(mblog, weibo_data)
+
+        full_content_for_matching = text if rt_text is None else f"{text} {rt_text}"
+        if not scraper.matches_keywords(full_content_for_matching):
+            return None
+
+        scraper.stats['keyword_matches'] += 1
+        await self.queue_images(mblog)
+
+        return weibo_data
+
+    @staticmethod
+    def page_mblogs(data):
+        """取出一页中的微博"""
+        return [
+            card.get('mblog') for card in data.get('data', {}).get('cards', [])
+            if card.get('card_type') == 9 and card.get('mblog')
+        ]
+
+    async def process_page(self, mblogs):
+        """并发处理一页中的微博，保持原有顺序"""
+        results = await asyncio.gather(*(self.process_mblog(mblog) for mblog in mblogs))
+        return [weibo for weibo in results if weibo]
+
+    def page_time_bounds(self, mblogs):
+        """一页中非置顶微博的 (最新时间, 最旧时间)；置顶微博可能很旧，不参与判断"""
+        dates = [
+            self.scraper.parse_created_at(m.get('created_at', ''))
+            for m in mblogs if not self.scraper.is_pinned(m)
+        ]
+        dates = [d for d in dates if d is not None]
+        if not dates:
+            return None, None
+        return max(dates), min(dates)
+
+    def is_newer_than_window(self, data):
+        """整页都晚于结束日期（时间窗口还在后面的页）"""
+        if data.get('ok') != 1:
+            return False
+        newest, oldest = self.page_time_bounds(self.page_mblogs(data))
+        return oldest is not None and oldest > self.scraper.date_window()[1]
+
+    async def locate_first_page(self):
+        """倍增探测 + 二分查找，定位第一个进入时间窗口的页码
+
+        微博列表按时间倒序，"整页晚于结束日期"对页码单调，因此可以二分。
+        """
+        if not self.is_newer_than_window(await self.load_page(1)):
+            return 1
+
+        # 倍增探测：lo 一定整页晚于窗口，hi 一定不是
+        lo, hi = 1, None
+        probe = 2
+        while probe <= self.max_search_page:
+            if not self.is_newer_than_window(await self.load_page(probe)):
+                hi = probe
+                break
+            lo = probe
+            probe *= 2
+
+        if hi is None:
+            return None
+
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.is_newer_than_window(await self.load_page(mid)):
+                lo = mid
+            else:
+                hi = mid
+
+        print(f"🔎 时间窗口从第 {hi} 页开始（定位共请求 {len(self._pages)} 页）")
+        return hi
+
+    async def run(self, progress_callback=None):
+        """执行爬取，返回符合条件的微博列表"""
+        scraper = self.scraper
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.text_concurrency + 2,
+            thread_name_prefix='weibo-crawl'
+        )
+        self._text_semaphore = asyncio.Semaphore(self.text_concurrency)
+        self._pages = {}
+
+        all_weibos = []
+        pending = None
+        start_dt = scraper.date_window()[0]
+
+        try:
+            if progress_callback:
+                progress_callback(0, "正在定位时间范围所在的页...")
+
+            try:
+                first_page = await self.locate_first_page()
+            except Exception as e:
+                print(f"❌ 定位时间窗口失败: {e}")
+                scraper.stop_reason = 'error'
+                return all_weibos
+
+            if first_page is None:
+                print(f"📝 前 {self.max_search_page} 页都晚于结束日期，没有符合时间范围的微博")
+                scraper.stop_reason = 'empty'
+                return all_weibos
+
+            # 从后面的页开始时，第1页的置顶微博也要处理（它们不在时间顺序里）
+            pinned = []
+            if first_page > 1:
+                pinned = [m for m in self.page_mblogs(self._pages[1]) if scraper.is_pinned(m)]
+
+            page = first_page
+            last_page = first_page + scraper.max_pages - 1
+            pending = asyncio.ensure_future(self.load_page(page))
+
+            while page <= last_page:
+                if progress_callback:
+                    queue_depth = scraper.image_pool.get_stats()['queue_depth']
+                    rate = scraper.current_rate()
+                    progress_callback(
+                        int((page - first_page) / scraper.max_pages * 100),
+                        f"正在获取第 {page} 页...（速率 {rate:.2f} 次/秒，图片队列 {queue_depth} 张）"
+                    )
+
+                print(f"\n📖 正在获取第 {page} 页...")
+
+                try:
+                    data = await pending
+                    pending = None
+                    self._pages.pop(page, None)
+
+                    if data.get('ok') != 1:
+                        print(f"❌ 第 {page} 页获取失败")
+                        scraper.stop_reason = 'error'
+                        break
+
+                    if not data.get('data', {}).get('cards', []):
+                        print(f"📝 第 {page} 页没有更多内容")
+                        scraper.stop_reason = 'empty'
+                        break
+
+                    mblogs = self.page_mblogs(data)
+                    newest, oldest = self.page_time_bounds(mblogs)
+
+                    # 整页早于开始日期：时间窗口已结束
+                    if newest is not None and newest < start_dt:
+                        print(f"📝 第 {page} 页已早于开始日期，停止翻页")
+                        scraper.walked_past_start = True
+                        scraper.stop_reason = 'past_start'
+                        break
+
+                    mblogs = pinned + mblogs
+                    pinned = []
+
+                    # 增量模式：已归档的微博不再处理，越过高水位线后不再翻页
+                    reached_high_water = any(
+                        scraper.reached_high_water(m) and not scraper.is_pinned(m) for m in mblogs
+                    )
+                    mblogs = [m for m in mblogs if not scraper.reached_high_water(m)]
+
+                    # 本页已越过开始日期时，下一页必然整页更早，无需预取
+                    crosses_start = oldest is not None and oldest < start_dt
+
+                    # 预取下一页，与本页的全文/图片处理重叠（发出时机由限速器决定）
+                    if page < last_page and not reached_high_water and not crosses_start:
+                        pending = asyncio.ensure_future(self.prefetch_page(page + 1))
+
+                    # 本页图片在下载池中继续下载，与下一页请求重叠
+                    page_weibos = await self.process_page(mblogs)
+                    all_weibos.extend(page_weibos)
+                    scraper.stats['filtered_weibos'] += len(page_weibos)
+                    scraper.stats['pages_processed'] += 1
+
+                    print(f"✅ 第 {page} 页获取到 {len(page_weibos)} 条符合条件的微博")
+
+                    if reached_high_water:
+                        print("📌 已到达归档高水位线，停止翻页")
+                        scraper.stop_reason = 'high_water'
+                        break
+
+                    if crosses_start:
+                        print("📝 已到达开始日期，停止翻页")
+                        scraper.stop_reason = 'past_start'
+                        break
+
+                    page += 1
+
+                except Exception as e:
+                    print(f"❌ 第 {page} 页获取失败: {e}")
+                    scraper.stop_reason = 'error'
+                    break
+            else:
+                scraper.stop_reason = 'max_pages'
+        finally:
+            self._discard(pending)
+            self._executor.shutdown(wait=True)
+            self._pages = {}
+
+        return all_weibos
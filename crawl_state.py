@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量爬取状态 - 按用户保存已归档的微博和高水位线（最新已见微博的ID/时间）
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+
+class CrawlArchive:
+    """单个用户的归档
+
+    high_water_id/high_water_time: 已归档的最新非置顶微博
+    covered_from: 从该时间到高水位线之间的微博都已完整归档（ISO格式时间）
+    weibos: 微博ID -> 微博数据（含 image_jobs，便于合并时补下载图片）
+    """
+    def __init__(self, user_id, high_water_id=None, high_water_time=None, covered_from=None, weibos=None):
+        self.user_id = user_id
+        self.high_water_id = high_water_id
+        self.high_water_time = high_water_time
+        self.covered_from = covered_from
+        self.weibos = weibos or {}
+
+    def covers(self, start_dt):
+        """归档是否完整覆盖了从 start_dt 到高水位线的区间"""
+        return bool(self.high_water_id and self.covered_from and self.covered_from <= start_dt.isoformat())
+
+    def is_archived(self, weibo_id):
+        """是否已到达（或越过）高水位线"""
+        try:
+            return self.high_water_id is not None and int(weibo_id) <= int(self.high_water_id)
+        except (TypeError, ValueError):
+            return False
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'high_water_id': self.high_water_id,
+            'high_water_time': self.high_water_time,
+            'covered_from': self.covered_from,
+            'weibos': self.weibos,
+        }
+
+
+# 归档文件路径 -> 锁；同一进程内的所有任务共用，同一用户的归档同时只有一个任务读写
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def _lock_for(path):
+    key = os.path.abspath(path)
+    with _path_locks_lock:
+        return _path_locks.setdefault(key, threading.Lock())
+
+
+class CrawlStateStore:
+    """按用户ID把归档保存为 data/crawl_state_{user_id}.json
+
+    同一用户的多个增量任务可能同时进行（如关键词不同），写入归档应使用 update()，
+    在锁内读取最新的归档再合并本任务的改动，不会覆盖其他任务写入的内容。
+    """
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.data_dir, f"crawl_state_{user_id}.json")
+
+    def load(self, user_id):
+        """读取归档，不存在或损坏时返回空归档"""
+        with _lock_for(self._path(user_id)):
+            return self._load(user_id)
+
+    def save(self, archive):
+        """原子写入归档（整体替换，并发任务应使用 update()）"""
+        with _lock_for(self._path(archive.user_id)):
+            self._save(archive)
+
+    def update(self, user_id, apply):
+        """在锁内读取最新的归档，调用 apply(归档) 合并改动后写入，返回合并后的归档"""
+        with _lock_for(self._path(user_id)):
+            archive = self._load(user_id)
+            apply(archive)
+            self._save(archive)
+        return archive
+
+    def _load(self, user_id):
+        try:
+            with open(self._path(user_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return CrawlArchive(user_id)
+        data.pop('user_id', None)
+        return CrawlArchive(user_id, **data)
+
+    def _save(self, archive):
+        """先写入唯一的临时文件再改名（多个进程同时写入也不会互相删除临时文件）"""
+        path = self._path(archive.user_id)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix='.tmp', dir=self.data_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(archive.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
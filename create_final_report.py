@@ -4,14 +4,14 @@
 创建最终完整报告 - 基于已下载的图片和现有数据
 """
 
-import ssl
-import urllib.request
 import json
 import re
 import os
 import glob
 from datetime import datetime
 import codecs
+from http_client import get_shared_client
+from text_cache import get_shared_text_cache
 from config import WEIBO_USER_ID, USER_NAME, OUTPUT_DIR, SIMPLE_FILENAME, START_DATE, END_DATE
 
 
@@ -36,9 +36,9 @@ def format_chinese_date(date_str):
 
 def get_sample_weibos_with_full_text():
     """获取包含全文的示例微博"""
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
+    http = get_shared_client()
+    text_cache = get_shared_text_cache(os.path.join(OUTPUT_DIR, "data", "long_text_cache.sqlite3"))
+    cache_stats = {}
     
     headers = {
         'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15',
@@ -66,15 +66,19 @@ def get_sample_weibos_with_full_text():
     
     def get_full_text(weibo_id):
         """获取微博全文"""
+        cached = text_cache.get(weibo_id, cache_stats)
+        if cached is not None:
+            return clean_html(cached)
+        
         full_text_url = f"https://m.weibo.cn/statuses/extend?id={weibo_id}"
         try:
-            req = urllib.request.Request(full_text_url, headers=headers)
-            response = urllib.request.urlopen(req, timeout=15, context=ssl_context)
+            response = http.get(full_text_url, headers=headers, timeout=15)
             content = response.read().decode('utf-8')
             data = json.loads(content)
             if data.get('ok') == 1:
                 full_text = data.get('data', {}).get('longTextContent', '')
                 if full_text:
+                    text_cache.put(weibo_id, full_text)
                     return clean_html(full_text)
         except Exception as e:
             print(f"获取全文失败: {e}")
@@ -84,8 +88,7 @@ def get_sample_weibos_with_full_text():
     url = f"https://m.weibo.cn/api/container/getIndex?type=uid&value={WEIBO_USER_ID}&containerid=107603{WEIBO_USER_ID}&page=1"
     
     try:
-        req = urllib.request.Request(url, headers=headers)
-        response = urllib.request.urlopen(req, timeout=30, context=ssl_context)
+        response = http.get(url, headers=headers, timeout=30)
         content = response.read().decode('utf-8')
         data = json.loads(content)
         
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享HTTP传输层 - 按主机维护keep-alive连接池，供所有爬虫复用
+"""
+
+import os
+import ssl
+import zlib
+import http.client
+import threading
+import urllib.error
+import urllib.parse
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，没有安装时不声明 br
+    brotli = None
+
+from rate_limiter import THROTTLE_STATUS_CODES, get_shared_limiter
+
+
+# 连接被服务端关闭时会抛出的异常（复用空闲连接时可能发生）
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# 流式下载时每次读取的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 请求时声明支持的压缩格式
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+
+
+class ResponseTooLarge(Exception):
+    """响应体超过调用方设定的字节上限"""
+
+
+def create_ssl_context():
+    """创建与原爬虫一致的SSL上下文（不校验证书）"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def decompress_body(body, content_encoding):
+    """按 Content-Encoding 解压响应体（多重编码时按相反顺序解开）"""
+    encodings = [e.strip().lower() for e in (content_encoding or '').split(',') if e.strip()]
+    for encoding in reversed(encodings):
+        if encoding in ('gzip', 'x-gzip'):
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            # 标准是zlib格式，但不少服务器直接发送raw deflate
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif encoding == 'br' and brotli:
+            body = brotli.decompress(body)
+        elif encoding != 'identity':
+            raise urllib.error.URLError(f"不支持的压缩格式: {encoding}")
+    return body
+
+
+class HTTPResponse:
+    """已读取完毕的HTTP响应
+
+    body 是解压后的内容，wire_size 是实际传输的字节数
+    """
+    def __init__(self, url, status, headers, body, wire_size=None):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.wire_size = len(body) if wire_size is None else wire_size
+
+    def read(self):
+        return self.body
+
+    def text(self, encoding='utf-8', errors='strict'):
+        return self.body.decode(encoding, errors)
+
+
+class PooledHTTPClient:
+    """按 (scheme, host, port) 维护空闲连接池的HTTP客户端，线程安全
+
+    传入 rate_limiter 时，每个请求先向限速器取令牌，并把响应状态反馈给限速器。
+    """
+    def __init__(self, ssl_context=None, max_idle_per_host=8, timeout=30, max_redirects=5, rate_limiter=None):
+        self.ssl_context = ssl_context or create_ssl_context()
+        self.rate_limiter = rate_limiter
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+
+        self._pools = {}
+        self._lock = threading.Lock()
+
+        # 统计信息（pool_hits 即省下的TCP+TLS握手次数）
+        self.stats = {
+            'requests': 0,
+            'pool_hits': 0,
+            'pool_misses': 0,
+            'stale_retries': 0,
+            'errors': 0,
+            'wire_bytes': 0,
+            'decoded_bytes': 0,
+        }
+        self.host_stats = {}
+
+    def _pool_key(self, parsed):
+        scheme = parsed.scheme or 'https'
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        return (scheme, parsed.hostname, port)
+
+    def _count(self, key, field, task_stats=None):
+        with self._lock:
+            self.stats[field] += 1
+            host = self.host_stats.setdefault(key[1], {'pool_hits': 0, 'pool_misses': 0})
+            if field in host:
+                host[field] += 1
+            if task_stats is not None:
+                task_stats[field] = task_stats.get(field, 0) + 1
+
+    def _count_bytes(self, wire_size, decoded_size, task_stats=None):
+        """累加传输字节数与解压后字节数"""
+        with self._lock:
+            self.stats['wire_bytes'] += wire_size
+            self.stats['decoded_bytes'] += decoded_size
+            if task_stats is not None:
+                task_stats['wire_bytes'] = task_stats.get('wire_bytes', 0) + wire_size
+                task_stats['decoded_bytes'] = task_stats.get('decoded_bytes', 0) + decoded_size
+
+    def _acquire(self, key, timeout, task_stats=None):
+        """从池中取一个空闲连接，没有则新建"""
+        with self._lock:
+            idle = self._pools.get(key)
+            conn = idle.pop() if idle else None
+
+        if conn is not None:
+            self._count(key, 'pool_hits', task_stats)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        self._count(key, 'pool_misses', task_stats)
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _release(self, key, conn, reusable):
+        """归还连接；不可复用或池已满时直接关闭"""
+        if reusable:
+            with self._lock:
+                idle = self._pools.setdefault(key, [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def _open(self, key, path, headers, timeout, task_stats=None):
+        """发出请求并读取响应头，复用的连接失效时换新连接重试；返回 (conn, response)"""
+        while True:
+            conn, reused = self._acquire(key, timeout, task_stats)
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn, conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    self._count(key, 'stale_retries')
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+    def _read(self, key, conn, response):
+        """读完响应体并归还连接"""
+        try:
+            body = response.read()
+        except Exception:
+            conn.close()
+            raise
+        self._release(key, conn, not response.will_close)
+        return body
+
+    def _open_url(self, url, headers, timeout, task_stats=None):
+        """发出GET请求并跟随重定向，返回 (最终url, key, conn, response)，响应体尚未读取"""
+        with self._lock:
+            self.stats['requests'] += 1
+
+        try:
+            for _ in range(self.max_redirects + 1):
+                parsed = urllib.parse.urlsplit(url)
+                key = self._pool_key(parsed)
+                path = parsed.path or '/'
+                if parsed.query:
+                    path = f"{path}?{parsed.query}"
+
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(parsed.hostname)
+
+                conn, response = self._open(key, path, headers, timeout, task_stats)
+
+                if self.rate_limiter:
+                    if response.status in THROTTLE_STATUS_CODES:
+                        self.rate_limiter.record_throttle(parsed.hostname)
+                    elif response.status < 400:
+                        self.rate_limiter.record_success(parsed.hostname)
+
+                if response.status in REDIRECT_CODES and response.getheader('Location'):
+                    self._read(key, conn, response)
+                    url = urllib.parse.urljoin(url, response.getheader('Location'))
+                    continue
+
+                if response.status >= 400:
+                    self._read(key, conn, response)
+                    raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+
+                return url, key, conn, response
+
+            raise urllib.error.URLError(f"重定向次数过多: {url}")
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+
+    def get(self, url, headers=None, timeout=None, task_stats=None):
+        """发送GET请求，自动跟随重定向和解压；状态码>=400时抛出 urllib.error.HTTPError
+
+        task_stats: 可选的调用方统计字典，会累加本次请求的 pool_hits/pool_misses
+            以及 wire_bytes（传输字节）/decoded_bytes（解压后字节）
+        """
+        timeout = timeout or self.timeout
+        request_headers = dict(headers or {})
+        request_headers.setdefault('Connection', 'keep-alive')
+        request_headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+
+        url, key, conn, response = self._open_url(url, request_headers, timeout, task_stats)
+        try:
+            body = self._read(key, conn, response)
+            wire_size = len(body)
+            body = decompress_body(body, response.getheader('Content-Encoding'))
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        self._count_bytes(wire_size, len(body), task_stats)
+
+        return HTTPResponse(url, response.status, response.msg, body, wire_size)
+
+    def download(self, url, filepath, headers=None, timeout=None, task_stats=None,
+                 max_bytes=None, on_chunk=None, chunk_size=CHUNK_SIZE):
+        """把响应体分块写入 filepath.part，完成后原子改名为 filepath，返回写入的字节数
+
+        max_bytes: 单个响应的字节上限，超过时抛出 ResponseTooLarge
+        on_chunk: 每写入一块时以块大小调用，可抛出异常中止下载（用于任务级配额）
+        中途失败时删除临时文件，半截文件不会出现在 filepath。
+        """
+        timeout = timeout or self.timeout
+        request_headers = dict(headers or {})
+        request_headers.setdefault('Connection', 'keep-alive')
+        # 图片本身已压缩，要求原样传输，按块直接落盘
+        request_headers['Accept-Encoding'] = 'identity'
+
+        url, key, conn, response = self._open_url(url, request_headers, timeout, task_stats)
+        tmp_path = f"{filepath}.part"
+        written = 0
+        try:
+            length = response.getheader('Content-Length')
+            if max_bytes and length and length.isdigit() and int(length) > max_bytes:
+                raise ResponseTooLarge(f"响应大小 {int(length)} 字节超过上限 {max_bytes} 字节: {url}")
+
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if max_bytes and written > max_bytes:
+                        raise ResponseTooLarge(f"响应超过上限 {max_bytes} 字节: {url}")
+                    if on_chunk:
+                        on_chunk(len(chunk))
+                    f.write(chunk)
+            # 分块读取在连接提前关闭时不会报错，需要自行核对长度
+            if length and length.isdigit() and written != int(length):
+                raise http.client.IncompleteRead(b'', int(length) - written)
+            os.replace(tmp_path, filepath)
+        except Exception:
+            # 连接上还有未读完的数据，不能放回池中
+            conn.close()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+
+        self._release(key, conn, not response.will_close)
+        self._count_bytes(written, written, task_stats)
+        return written
+
+    def report_throttle(self, url):
+        """调用方发现业务层限流（如 ok != 1）时通知限速器"""
+        if self.rate_limiter:
+            self.rate_limiter.record_throttle(urllib.parse.urlsplit(url).hostname)
+
+    def get_rate(self, url):
+        """目标主机当前的请求速率（次/秒），未启用限速时返回 None"""
+        if self.rate_limiter:
+            return self.rate_limiter.get_rate(urllib.parse.urlsplit(url).hostname)
+        return None
+
+    def get_stats(self):
+        """返回连接池统计快照"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['hosts'] = {host: dict(values) for host, values in self.host_stats.items()}
+            stats['idle_connections'] = sum(len(idle) for idle in self._pools.values())
+        return stats
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_client():
+    """获取进程内共享的HTTP客户端（跨请求、跨任务复用连接）"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = PooledHTTPClient(rate_limiter=get_shared_limiter())
+        return _shared_client
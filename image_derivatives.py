@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片衍生品 - 为报告和Web界面生成限宽、重新压缩的显示图，按内容哈希缓存在图片库的 derived/ 目录下
+"""
+
+import os
+import threading
+import uuid
+
+from image_store import is_blob_name
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 是可选依赖，没有安装时报告直接使用原图
+    Image = None
+
+
+# 报告正文最宽 800px，显示图不必更大
+DISPLAY_WIDTH = 800
+DISPLAY_QUALITY = 82
+
+
+def derivatives_available():
+    """是否能生成显示图（需要Pillow）"""
+    return Image is not None
+
+
+def derivative_name(blob, width=DISPLAY_WIDTH):
+    """图片库中的图片名（含sha256）-> 显示图名（相对图片库目录）"""
+    stem = os.path.splitext(blob)[0]
+    return f"derived/{stem}_w{width}.jpg"
+
+
+def make_derivative(source_path, dest_path, width=DISPLAY_WIDTH, quality=DISPLAY_QUALITY):
+    """生成宽度不超过 width 的JPEG显示图，已存在时直接返回
+
+    动图、已经足够小的JPEG、以及重新压缩后反而更大的图片不生成显示图，返回 None；
+    无法生成（如图片损坏）时抛出异常。临时文件名唯一，并发生成同一张显示图也不会互相干扰。
+    """
+    if os.path.exists(dest_path):
+        return dest_path
+    if Image is None:
+        return None
+
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    try:
+        with Image.open(source_path) as image:
+            if getattr(image, 'is_animated', False):
+                return None
+            if image.width <= width and image.format == 'JPEG':
+                return None
+
+            image.thumbnail((width, image.height))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+        if os.path.getsize(tmp_path) >= os.path.getsize(source_path):
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return dest_path
+
+
+class ImageDerivatives:
+    """图片库的显示图，线程安全
+
+    display_name() 返回报告中应使用的文件名：有显示图时为显示图，否则为原图；
+    不是合法图片名或图片不存在时返回 None。结果在进程内缓存，同一张图只判断、生成一次
+    （并发请求同一张图时等待先到的那次）；生成出错时本次使用原图，不缓存，下次重试。
+    """
+    def __init__(self, root, width=DISPLAY_WIDTH, quality=DISPLAY_QUALITY):
+        self.root = root
+        self.width = width
+        self.quality = quality
+
+        self._names = {}
+        self._blob_locks = {}
+        self._lock = threading.Lock()
+
+    def display_name(self, blob):
+        with self._lock:
+            name = self._names.get(blob)
+        if name is not None:
+            return name
+        if not is_blob_name(blob) or not os.path.isfile(os.path.join(self.root, blob)):
+            return None
+
+        with self._lock:
+            blob_lock = self._blob_locks.setdefault(blob, threading.Lock())
+        with blob_lock:
+            with self._lock:
+                name = self._names.get(blob)
+            if name is not None:
+                return name
+
+            derived = derivative_name(blob, self.width)
+            try:
+                made = make_derivative(
+                    os.path.join(self.root, blob), os.path.join(self.root, derived), self.width, self.quality
+                )
+            except Exception as e:
+                print(f"⚠️ 生成显示图失败: {blob} - {e}")
+                return blob
+            name = derived if made else blob
+
+            with self._lock:
+                self._names[blob] = name
+                self._blob_locks.pop(blob, None)
+        return name
+
+
+_shared_derivatives = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_derivatives(root):
+    """按图片库目录获取进程内共享的实例"""
+    key = os.path.abspath(root)
+    with _shared_lock:
+        derivatives = _shared_derivatives.get(key)
+        if derivatives is None:
+            derivatives = ImageDerivatives(root)
+            _shared_derivatives[key] = derivatives
+        return derivatives
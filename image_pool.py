@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片下载池 - 有界队列 + 固定数量的下载线程，爬取流程只需排队即可继续
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+
+from http_client import ResponseTooLarge, get_shared_client
+
+
+_STOP = object()
+
+
+class ByteBudget:
+    """任务级的图片字节配额，线程安全；limit 为 None 时不限制"""
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """占用 size 字节，超出配额时抛出 ResponseTooLarge"""
+        with self._lock:
+            if self.limit is not None and self.used + size > self.limit:
+                raise ResponseTooLarge(f"任务图片总量超过上限 {self.limit} 字节")
+            self.used += size
+
+    def release(self, size):
+        """归还未落盘的字节（下载中途失败时）"""
+        with self._lock:
+            self.used = max(0, self.used - size)
+
+    def exhausted(self):
+        with self._lock:
+            return self.limit is not None and self.used >= self.limit
+
+
+class ImageDownloadPool:
+    """有界图片下载池
+
+    submit() 返回 concurrent.futures.Future，结果为本地路径，失败时为 None。
+    队列已满时 submit() 会阻塞，对爬取流程形成背压。
+    图片按块写入临时文件后原子改名，max_image_bytes 限制单张图片大小。
+    传入 image_store 时图片存入内容寻址图片库，已入库或正在下载的链接不再重复下载。
+    """
+    def __init__(self, max_workers=6, max_queue=200, http_client=None, timeout=15, max_image_bytes=None,
+                 image_store=None):
+        self.max_workers = max(1, max_workers)
+        self.http = http_client or get_shared_client()
+        self.timeout = timeout
+        self.max_image_bytes = max_image_bytes
+        self.image_store = image_store
+        self._inflight = {}
+
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._threads = []
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'queued': 0,
+            'active': 0,
+            'completed': 0,
+            'skipped': 0,
+            'deduplicated': 0,
+            'failed': 0,
+            'oversized': 0,
+            'bytes': 0,
+        }
+        self._started_at = None
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.time()
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f"image-pool-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _count(self, field, value=1, task_stats=None, task_field=None):
+        with self._lock:
+            self.stats[field] += value
+            if task_stats is not None and task_field:
+                task_stats[task_field] = task_stats.get(task_field, 0) + value
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                self._queue.task_done()
+                return
+
+            future, image_url, filepath, headers, task_stats, max_bytes, budget, on_done = job
+            if not future.set_running_or_notify_cancel():
+                self._queue.task_done()
+                continue
+
+            self._count('active')
+            try:
+                if self.image_store is not None:
+                    result = self._store_image(future, image_url, headers, task_stats, max_bytes, budget)
+                else:
+                    result = self._download(image_url, filepath, headers, task_stats, max_bytes, budget)
+                if result and on_done:
+                    on_done(result)
+                future.set_result(result)
+            except Exception as e:  # 兜底，保证 Future 一定有结果
+                self._count('failed')
+                print(f"❌ 下载图片失败: {e}")
+                future.set_result(None)
+            finally:
+                self._count('active', -1)
+                self._queue.task_done()
+
+    def _download(self, image_url, filepath, headers, task_stats, max_bytes=None, budget=None, label=None):
+        """流式下载单张图片到 filepath，返回路径；失败或超过上限返回 None"""
+        if os.path.exists(filepath):
+            self._count('skipped')
+            return filepath
+
+        if budget is not None and budget.exhausted():
+            self._count('oversized', 1, task_stats, 'images_oversized')
+            print(f"⚠️ 图片总量已达上限，跳过: {image_url}")
+            return None
+
+        consumed = []
+
+        def on_chunk(size):
+            if budget is not None:
+                budget.consume(size)
+            consumed.append(size)
+
+        try:
+            size = self.http.download(
+                image_url, filepath, headers=headers, timeout=self.timeout, task_stats=task_stats,
+                max_bytes=max_bytes or self.max_image_bytes, on_chunk=on_chunk
+            )
+        except ResponseTooLarge as e:
+            if budget is not None:
+                budget.release(sum(consumed))
+            self._count('oversized', 1, task_stats, 'images_oversized')
+            print(f"⚠️ 图片过大，已跳过: {image_url} - {e}")
+            return None
+        except Exception as e:
+            if budget is not None:
+                budget.release(sum(consumed))
+            self._count('failed', 1, task_stats, 'images_failed')
+            print(f"❌ 下载图片失败: {image_url} - {e}")
+            return None
+
+        self._count('completed', 1, task_stats, 'images_downloaded')
+        self._count('bytes', size, task_stats, 'image_bytes')
+        print(f"✅ 下载图片: {label or os.path.basename(filepath)}")
+        return filepath
+
+    def _store_image(self, future, image_url, headers, task_stats, max_bytes=None, budget=None):
+        """经图片库获取图片，返回图片路径；失败返回 None"""
+        store = self.image_store
+        path = store.lookup_url(image_url)
+
+        if path is not None:
+            self._count('deduplicated', 1, task_stats, 'images_deduplicated')
+        else:
+            # 同一链接同时只下载一次，其余的等待先到的那次
+            with self._lock:
+                primary = self._inflight.setdefault(image_url, future)
+
+            if primary is not future:
+                path = primary.result()
+                if path is not None:
+                    self._count('deduplicated', 1, task_stats, 'images_deduplicated')
+            else:
+                try:
+                    label = image_url.rsplit('/', 1)[-1]
+                    tmp_path = self._download(image_url, store.temp_path(), headers, task_stats, max_bytes, budget, label)
+                    path = store.ingest(tmp_path, image_url) if tmp_path else None
+                finally:
+                    with self._lock:
+                        self._inflight.pop(image_url, None)
+
+        return path
+
+    def submit(self, image_url, filepath=None, headers=None, task_stats=None, max_bytes=None, budget=None,
+               on_done=None):
+        """排队下载一张图片
+
+        filepath: 不使用图片库时的保存路径
+        task_stats: 可选的调用方统计字典，累加 images_downloaded/image_bytes/images_failed/
+            images_oversized/images_deduplicated
+        max_bytes: 单张图片的字节上限，默认使用 max_image_bytes
+        budget: 可选的 ByteBudget，同一任务的所有图片共用
+        on_done: 下载成功后、Future 完成前以图片路径调用（等待 Future 的一方能看到其结果）
+        """
+        self._ensure_workers()
+        future = Future()
+        self._count('queued')
+        self._queue.put((future, image_url, filepath, headers or {}, task_stats, max_bytes, budget, on_done))
+        return future
+
+    def wait(self, futures, timeout=None):
+        """等待指定的下载完成（只等需要的图片）"""
+        futures = [f for f in futures if f is not None]
+        if futures:
+            wait(futures, timeout=timeout)
+
+    def get_stats(self):
+        """队列深度、吞吐和失败数"""
+        with self._lock:
+            stats = dict(self.stats)
+            elapsed = time.time() - self._started_at if self._started_at else 0
+        stats['queue_depth'] = self._queue.qsize()
+        stats['bytes_per_sec'] = int(stats['bytes'] / elapsed) if elapsed > 0 else 0
+        return stats
+
+    def shutdown(self, wait=True):
+        """停止下载线程"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        if wait:
+            for thread in threads:
+                thread.join()
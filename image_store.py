@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容寻址图片库 - 图片按内容的sha256命名，同一张图只存一份；清单记录 原链接 -> 图片
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# 文件头特征 -> 扩展名
+MAGIC_EXTENSIONS = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+
+
+# 图片库中的图片名: <哈希前两位>/<sha256>.<ext>
+BLOB_NAME = re.compile(r'^([0-9a-f]{2})/\1[0-9a-f]{62}\.(?:jpg|png|gif|webp)$')
+
+
+def is_blob_name(name):
+    """是否为合法的图片名（外部传入的名字必须先检查，防止访问图片库以外的文件）"""
+    return bool(BLOB_NAME.match(name))
+
+
+# 每张微博图片可选的清晰度：缩略图 / 中图 / 大图 / 不下载
+IMAGE_QUALITIES = ('thumbnail', 'bmiddle', 'large', 'none')
+
+# sinaimg 链接中表示尺寸的路径段，如 /orj360/、/thumb150/、/mw690/、/large/
+SIZE_SEGMENT = re.compile(r'/(?:thumbnail|thumb\d+|orj\d+|bmiddle|mw\d+|large|original|woriginal)/')
+
+
+def variant_url(image_url, quality):
+    """把 sinaimg 图片链接换成指定清晰度；不是标准尺寸路径的链接原样返回"""
+    if quality == 'none':
+        return ''
+    return SIZE_SEGMENT.sub(f'/{quality}/', image_url, count=1)
+
+
+def select_pic_url(pic, quality='large'):
+    """从 pics 中的一项取得指定清晰度的图片链接，quality 为 none 时返回空字符串
+
+    pics 项里 url 是缩略图，large.url 是大图，中图由尺寸路径段替换得到。
+    """
+    if quality == 'none':
+        return ''
+    large = (pic.get('large') or {}).get('url', '')
+    small = pic.get('url', '')
+    if quality == 'large':
+        return large or small
+    if quality == 'thumbnail' and small:
+        return small
+    return variant_url(large or small, quality)
+
+
+def guess_extension(image_url):
+    """根据链接猜测扩展名"""
+    path = image_url.split('?')[0].lower()
+    for ext in ('jpg', 'jpeg', 'png', 'gif', 'webp'):
+        if path.endswith('.' + ext):
+            return 'jpg' if ext == 'jpeg' else ext
+    return 'jpg'
+
+
+def sniff_extension(head, fallback='jpg'):
+    """根据文件头判断图片格式，无法识别时使用 fallback"""
+    for magic, ext in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return fallback
+
+
+class ImageStore:
+    """内容寻址图片库，线程安全
+
+    图片保存为 root/<哈希前两位>/<sha256>.<ext>，清单 image_urls（原链接 -> 图片）保存在SQLite中；
+    微博与图片的对应关系由各任务的 TaskImageManifest 记录。
+    """
+    def __init__(self, root, manifest_path):
+        self.root = root
+        self.manifest_path = manifest_path
+        self.tmp_dir = os.path.join(root, '.tmp')
+
+        self._lock = threading.Lock()
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(manifest_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_urls ("
+            "url TEXT PRIMARY KEY, blob TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def blob_path(self, blob):
+        """图片名 -> 本地路径"""
+        return os.path.join(self.root, blob)
+
+    def lookup_url(self, image_url):
+        """该链接已入库时返回图片路径，否则返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT blob FROM image_urls WHERE url = ?", (image_url,)).fetchone()
+        if row and os.path.exists(self.blob_path(row[0])):
+            return self.blob_path(row[0])
+        return None
+
+    def describe(self, image_url):
+        """已入库链接的 {'blob', 'size', 'mime'}，未入库时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT blob, size FROM image_urls WHERE url = ?", (image_url,)).fetchone()
+        if not row:
+            return None
+        blob, size = row
+        return {'blob': blob, 'size': size, 'mime': MIME_TYPES.get(blob.rsplit('.', 1)[-1], 'image/jpeg')}
+
+    def temp_path(self):
+        """下载用的临时文件路径"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def ingest(self, tmp_path, image_url):
+        """把下载好的临时文件按内容哈希入库，返回图片路径；内容已存在时丢弃临时文件"""
+        digest = hashlib.sha256()
+        with open(tmp_path, 'rb') as f:
+            head = f.read(16)
+            digest.update(head)
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        size = os.path.getsize(tmp_path)
+
+        sha = digest.hexdigest()
+        blob = f"{sha[:2]}/{sha}.{sniff_extension(head, guess_extension(image_url))}"
+        path = self.blob_path(blob)
+
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_urls (url, blob, size, stored_at) VALUES (?, ?, ?, ?)",
+                (image_url, blob, size, time.time())
+            )
+            self._conn.commit()
+        return path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TaskImageManifest:
+    """单个任务的图片清单，下载完成时记录，报告和压缩包直接读取，无需探测文件系统
+
+    每项: {'weibo_id', 'index', 'retweet', 'path'（相对图片库）, 'size', 'mime', 'url'}
+    """
+    def __init__(self):
+        self._by_weibo = {}
+        self._lock = threading.Lock()
+
+    def record(self, weibo_id, index, retweet, path, size, mime, url):
+        entry = {
+            'weibo_id': str(weibo_id),
+            'index': index,
+            'retweet': retweet,
+            'path': path,
+            'size': size,
+            'mime': mime,
+            'url': url,
+        }
+        with self._lock:
+            self._by_weibo.setdefault(str(weibo_id), {})[(retweet, index)] = entry
+
+    def images(self, weibo_id):
+        """一条微博的图片：原创图片在前，转发图片在后，各自按序号排列"""
+        with self._lock:
+            entries = self._by_weibo.get(str(weibo_id), {})
+            return [entries[key] for key in sorted(entries)]
+
+    def entries(self):
+        with self._lock:
+            return [e for entries in self._by_weibo.values() for e in entries.values()]
+
+    def paths(self):
+        """清单中的全部图片路径（去重）"""
+        return sorted({e['path'] for e in self.entries()})
+
+    def __len__(self):
+        return len(self.entries())
+
+    def save(self, path):
+        """把清单写入JSON文件（先写临时文件再改名）"""
+        entries = sorted(self.entries(), key=lambda e: (e['weibo_id'], e['retweet'], e['index']))
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_image_store(root, manifest_path):
+    """按图片库目录获取进程内共享的实例"""
+    key = os.path.abspath(root)
+    with _shared_lock:
+        store = _shared_stores.get(key)
+        if store is None:
+            store = ImageStore(root, manifest_path)
+            _shared_stores[key] = store
+        return store
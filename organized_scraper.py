@@ -4,28 +4,30 @@
 组织化微博爬虫 - 所有输出文件保存到指定目录结构
 """
 
-import ssl
-import urllib.request
-import urllib.parse
 import json
 import re
 import os
-import hashlib
 from datetime import datetime, timedelta
 import codecs
+from http_client import ACCEPT_ENCODING, get_shared_client
+from text_cache import get_shared_text_cache, hit_ratio
+from image_pool import ImageDownloadPool
+from image_store import IMAGE_QUALITIES, get_shared_image_store, select_pic_url
 
 
 class OrganizedWeiboScraper:
-    def __init__(self, output_base_dir="weibo_output"):
-        # SSL设置
-        self.ssl_context = ssl.create_default_context()
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_NONE
+    def __init__(self, output_base_dir="weibo_output", image_quality="large"):
+        # 共享HTTP客户端（按主机复用keep-alive连接）
+        self.http = get_shared_client()
+        
+        # 图片清晰度（thumbnail/bmiddle/large，none 为不下载图片）
+        self.image_quality = image_quality if image_quality in IMAGE_QUALITIES else 'large'
         
         self.uid = "1317335037"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
             'Accept': 'application/json, text/plain, */*',
+            'Accept-Encoding': ACCEPT_ENCODING,
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Referer': f'https://m.weibo.cn/u/{self.uid}',
             'Connection': 'keep-alive',
@@ -42,6 +44,14 @@ class OrganizedWeiboScraper:
             if not os.path.exists(directory):
                 os.makedirs(directory)
                 print(f"📁 创建目录: {directory}")
+        
+        # 全文缓存（跨任务持久化）
+        self.text_cache = get_shared_text_cache(os.path.join(self.data_dir, "long_text_cache.sqlite3"))
+        self.cache_stats = {'text_cache_hits': 0, 'text_cache_misses': 0}
+        
+        # 内容寻址图片库 + 图片下载池
+        self.image_store = get_shared_image_store(self.images_dir, os.path.join(self.data_dir, "image_manifest.sqlite3"))
+        self.image_pool = ImageDownloadPool(max_workers=6, timeout=30, image_store=self.image_store)
 
     def decode_text_properly(self, text):
         """正确解码Unicode文本"""
@@ -98,8 +108,7 @@ class OrganizedWeiboScraper:
         """发送HTTP请求"""
         for attempt in range(max_retries):
             try:
-                req = urllib.request.Request(url, headers=self.headers)
-                response = urllib.request.urlopen(req, timeout=30, context=self.ssl_context)
+                response = self.http.get(url, headers=self.headers, timeout=30)
                 
                 content_bytes = response.read()
                 try:
@@ -113,14 +122,18 @@ class OrganizedWeiboScraper:
                 return content
                 
             except Exception as e:
+                # 失败后降低该主机速率，下次重试由限速器决定等待时间
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2)
+                    self.http.report_throttle(url)
                     
         return None
 
     def get_full_text(self, weibo_id):
         """获取微博全文"""
+        cached = self.text_cache.get(weibo_id, self.cache_stats)
+        if cached is not None:
+            return self.clean_html_and_decode(cached)
+        
         full_text_url = f"https://m.weibo.cn/statuses/extend?id={weibo_id}"
         
         try:
@@ -130,44 +143,42 @@ class OrganizedWeiboScraper:
                 if data.get('ok') == 1:
                     full_text = data.get('data', {}).get('longTextContent', '')
                     if full_text:
+                        self.text_cache.put(weibo_id, full_text)
                         return self.clean_html_and_decode(full_text)
+                else:
+                    self.http.report_throttle(full_text_url)
         except Exception as e:
             print(f"  获取全文失败: {e}")
         
         return None
 
+    def queue_image(self, image_url, weibo_id, image_index):
+        """把图片排入下载池（存入图片库），返回 Future"""
+        return self.image_pool.submit(image_url, headers={
+            'User-Agent': self.headers['User-Agent'],
+            'Referer': 'https://weibo.com/'
+        })
+
+    def local_image_name(self, image_path):
+        """图片库中的路径 -> 相对images目录的文件名"""
+        return os.path.relpath(image_path, self.images_dir).replace(os.sep, '/')
+
     def download_image(self, image_url, weibo_id, image_index):
-        """下载图片到images目录"""
-        try:
-            # 生成文件名
-            image_ext = image_url.split('.')[-1].split('?')[0]
-            if not image_ext or image_ext not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                image_ext = 'jpg'
-            
-            filename = f"{weibo_id}_{image_index}.{image_ext}"
-            filepath = os.path.join(self.images_dir, filename)
-            
-            # 如果文件已存在，跳过下载
-            if os.path.exists(filepath):
-                return filename
-            
-            # 下载图片
-            req = urllib.request.Request(image_url, headers={
-                'User-Agent': self.headers['User-Agent'],
-                'Referer': 'https://weibo.com/'
-            })
-            
-            response = urllib.request.urlopen(req, timeout=30, context=self.ssl_context)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.read())
-            
-            print(f"    ✅ 下载图片: images/{filename}")
-            return filename
-            
-        except Exception as e:
-            print(f"    ❌ 下载图片失败: {image_url} - {e}")
-            return None
+        """下载图片到图片库，返回相对images目录的文件名"""
+        image_path = self.queue_image(image_url, weibo_id, image_index).result()
+        return self.local_image_name(image_path) if image_path else None
+
+    def wait_for_images(self, weibos):
+        """等待这些微博的图片下载完成，按图片库中的位置填入本地文件名（失败时为 None）"""
+        futures = [img['future'] for w in weibos for img in w.get('images', []) if img.get('future')]
+        self.image_pool.wait(futures)
+        
+        for weibo in weibos:
+            for img in weibo.get('images', []):
+                future = img.pop('future', None)
+                if future is not None:
+                    image_path = future.result()
+                    img['local_file'] = self.local_image_name(image_path) if image_path else None
 
     def generate_weibo_url(self, weibo_id, mid=None):
         """生成微博链接"""
@@ -254,16 +265,17 @@ class OrganizedWeiboScraper:
             
             # 处理图片
             if 'pics' in mblog and mblog['pics']:
-                print(f"    🖼️ 发现 {len(mblog['pics'])} 张图片，开始下载...")
+                print(f"    🖼️ 发现 {len(mblog['pics'])} 张图片，加入下载队列...")
                 weibo['images'] = []
                 for idx, pic in enumerate(mblog['pics'], 1):
-                    pic_url = pic.get('large', {}).get('url', '') or pic.get('url', '')
+                    pic_url = select_pic_url(pic, self.image_quality)
                     if pic_url:
-                        # 下载图片
-                        local_filename = self.download_image(pic_url, weibo_id, idx)
+                        # 排队下载图片，不阻塞后续处理
+                        future = self.queue_image(pic_url, weibo_id, idx)
                         weibo['images'].append({
                             'url': pic_url,
-                            'local_file': local_filename
+                            'local_file': None,
+                            'future': future
                         })
             
             # 处理转发内容
@@ -292,13 +304,14 @@ class OrganizedWeiboScraper:
                         weibo['images'] = []
                     
                     for idx, pic in enumerate(rt['pics'], len(weibo.get('images', [])) + 1):
-                        pic_url = pic.get('large', {}).get('url', '') or pic.get('url', '')
+                        pic_url = select_pic_url(pic, self.image_quality)
                         if pic_url:
-                            local_filename = self.download_image(pic_url, f"{weibo_id}_rt", idx)
+                            future = self.queue_image(pic_url, weibo_id, f"rt_{idx}")
                             weibo['images'].append({
                                 'url': pic_url,
-                                'local_file': local_filename,
-                                'from_retweet': True
+                                'local_file': None,
+                                'from_retweet': True,
+                                'future': future
                             })
             
             return weibo
@@ -315,7 +328,7 @@ class OrganizedWeiboScraper:
         print(f"🔍 开始爬取用户 {self.uid} 的完整微博内容...")
         
         for page in range(1, 11):  # 先爬10页测试
-            print(f"\n📄 爬取第 {page} 页...")
+            print(f"\n📄 爬取第 {page} 页...（当前速率 {self.http.get_rate('https://m.weibo.cn/') or 0:.2f} 次/秒）")
             
             url = f"https://m.weibo.cn/api/container/getIndex?type=uid&value={self.uid}&containerid={container_id}&page={page}"
             
@@ -329,6 +342,7 @@ class OrganizedWeiboScraper:
                 
                 if data.get('ok') != 1:
                     print(f"❌ API错误: {data.get('msg', '未知')}")
+                    self.http.report_throttle(url)
                     break
                 
                 cards = data.get('data', {}).get('cards', [])
@@ -354,8 +368,7 @@ class OrganizedWeiboScraper:
                 else:
                     print(f"⚠️ 第 {page} 页无目标微博")
                 
-                import time
-                time.sleep(3)  # 页面间延迟
+                # 页面间隔由共享限速器控制，不再固定等待
                 
             except Exception as e:
                 print(f"❌ 处理第 {page} 页失败: {e}")
@@ -489,6 +502,11 @@ class OrganizedWeiboScraper:
         print(f"\n📊 爬取完成: {len(weibos)} 条微博")
         
         if weibos:
+            pool_stats = self.image_pool.get_stats()
+            print(f"\n⏳ 等待图片下载完成（队列中 {pool_stats['queue_depth']} 张）...")
+            self.wait_for_images(weibos)
+            self.image_pool.shutdown()
+            
             print("\n💾 保存数据文件...")
             
             # 保存JSON数据
@@ -507,6 +525,12 @@ class OrganizedWeiboScraper:
             print(f"💾 数据文件: data/{json_filename}")
             print(f"📊 微博数量: {len(weibos)} 条")
             print(f"🖼️ 图片下载: {total_images} 张 (保存在 images/ 目录)")
+            pool_stats = self.image_pool.get_stats()
+            print(f"📥 图片流量: {pool_stats['bytes'] / 1024:.0f} KB，{pool_stats['bytes_per_sec'] / 1024:.0f} KB/s，失败 {pool_stats['failed']} 张")
+            http_stats = self.http.get_stats()
+            print(f"🔌 连接复用: {http_stats['pool_hits']} 次，新建连接: {http_stats['pool_misses']} 次")
+            print(f"🗜️ 传输流量: {http_stats['wire_bytes'] / 1024:.0f} KB，解压后: {http_stats['decoded_bytes'] / 1024:.0f} KB")
+            print(f"📚 全文缓存命中率: {hit_ratio(self.cache_stats):.0%}（命中 {self.cache_stats['text_cache_hits']} 次）")
             
             return {
                 'output_dir': self.output_base,
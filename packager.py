@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果打包 - 图片等已压缩的媒体文件原样存储，只压缩文本；每个文件只写入一次
+既可以生成压缩包文件，也可以边生成边发送（不落盘，内存占用恒定）
+"""
+
+import os
+import threading
+import time
+import uuid
+import zipfile
+
+
+# 已经压缩过的格式，再用deflate压缩几乎没有收益
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip')
+
+# 流式打包时每次读取、发送的块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def compress_type_for(arcname):
+    """媒体文件用 ZIP_STORED，其余用 ZIP_DEFLATED"""
+    if arcname.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def build_package(zip_filename, members):
+    """按 [(压缩包内路径, 本地路径)] 生成压缩包，重复的路径只写第一次
+
+    先写入临时文件（文件名唯一，同时生成同一个压缩包也不会冲突）再改名，返回 {'files', 'size', 'seconds'}。
+    """
+    start = time.perf_counter()
+    tmp_filename = f"{zip_filename}.{uuid.uuid4().hex}.part"
+    written = set()
+
+    try:
+        with zipfile.ZipFile(tmp_filename, 'w') as zipf:
+            for arcname, path in members:
+                if arcname in written:
+                    continue
+                zipf.write(path, arcname, compress_type=compress_type_for(arcname))
+                written.add(arcname)
+        os.replace(tmp_filename, zip_filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    return {
+        'files': len(written),
+        'size': os.path.getsize(zip_filename),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+class _StreamSink:
+    """只写、不可seek的输出，zipfile 写入的数据暂存在这里，由生成器取走发送"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_package(members, chunk_size=STREAM_CHUNK_SIZE):
+    """边生成边输出压缩包的生成器，members 为 (压缩包内路径, 本地路径) 的可迭代对象
+
+    members 可以是 LivePackage：成员就绪一个发送一个，迭代阻塞时发送也随之等待。
+    重复的路径只写第一次，已不存在的文件跳过。
+    """
+    sink = _StreamSink()
+    written = set()
+
+    # 输出不可seek，zipfile 会在每个成员后写数据描述符，无需回填文件头
+    with zipfile.ZipFile(sink, 'w') as zipf:
+        for arcname, path in members:
+            if arcname in written:
+                continue
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            except OSError as e:
+                print(f"⚠️ 打包时跳过文件: {path} - {e}")
+                continue
+            zinfo.compress_type = compress_type_for(arcname)
+
+            with open(path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            written.add(arcname)
+
+            data = sink.drain()
+            if data:
+                yield data
+
+    data = sink.drain()
+    if data:
+        yield data
+
+
+class LivePackage:
+    """逐步就绪的压缩包成员列表，线程安全
+
+    爬取任务在图片下载完成、报告生成后 add()，结束时 close()；
+    迭代时按加入顺序产出成员，没有新成员时阻塞等待，close() 后结束。
+    任务失败时 close(error)，正在进行的迭代抛出异常，下载随之中断。
+    可以多次迭代，每次都从头开始。
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self._members = []
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def add(self, arcname, path):
+        with self._cond:
+            self._members.append((arcname, path))
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self._closed = True
+            self._error = error
+            self._cond.notify_all()
+
+    def members(self):
+        """当前已加入的成员（副本）"""
+        with self._cond:
+            return list(self._members)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._members) and not self._closed:
+                    self._cond.wait()
+                if self._error is not None:
+                    raise RuntimeError(f"任务失败，压缩包不完整: {self._error}")
+                if index >= len(self._members):
+                    return
+                member = self._members[index]
+            index += 1
+            yield member
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应限速器 - 按主机的令牌桶，AIMD调整速率（正常时加性提速，被限流时乘性降速）
+"""
+
+import threading
+import time
+
+
+# 按主机后缀的默认参数（速率单位：次/秒）
+HOST_PROFILES = {
+    'weibo.cn': {'rate': 0.5, 'min_rate': 0.1, 'max_rate': 3.0, 'capacity': 5},
+    'sinaimg.cn': {'rate': 8.0, 'min_rate': 1.0, 'max_rate': 30.0, 'capacity': 10},
+}
+DEFAULT_PROFILE = {'rate': 2.0, 'min_rate': 0.2, 'max_rate': 10.0, 'capacity': 5}
+
+# 视为被限流的HTTP状态码
+THROTTLE_STATUS_CODES = (418, 429)
+
+
+class TokenBucket:
+    """单个主机的令牌桶"""
+    def __init__(self, rate, min_rate, max_rate, capacity):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = capacity
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.last_used_at = None
+        self.throttled = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class AdaptiveRateLimiter:
+    """按主机限速，线程安全"""
+    def __init__(self, increase=0.05, decrease_factor=0.5, idle_reset=60):
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.idle_reset = idle_reset
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _profile(self, host):
+        for suffix, profile in HOST_PROFILES.items():
+            if host == suffix or host.endswith('.' + suffix):
+                return profile
+        return DEFAULT_PROFILE
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(**self._profile(host))
+            self._buckets[host] = bucket
+        return bucket
+
+    def configure(self, host, rate):
+        """为主机设置起始速率；已有其他任务在自适应调整时保持当前速率"""
+        with self._lock:
+            bucket = self._bucket(host)
+            if bucket.last_used_at is None or time.monotonic() - bucket.last_used_at > self.idle_reset:
+                bucket.rate = min(bucket.max_rate, max(bucket.min_rate, rate))
+
+    def acquire(self, host):
+        """取一个令牌，必要时阻塞等待；返回等待的秒数"""
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            bucket.refill(now)
+            bucket.tokens -= 1
+            bucket.last_used_at = now
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_success(self, host):
+        """请求正常：加性提速"""
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.rate = min(bucket.max_rate, bucket.rate + self.increase)
+
+    def record_throttle(self, host):
+        """被限流（418/429/ok!=1）：乘性降速并清空令牌"""
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.refill(time.monotonic())
+            bucket.rate = max(bucket.min_rate, bucket.rate * self.decrease_factor)
+            bucket.tokens = min(bucket.tokens, 0)
+            bucket.throttled += 1
+        print(f"🐢 {host} 触发限流，速率降至 {self.get_rate(host):.2f} 次/秒")
+
+    def get_rate(self, host):
+        """当前速率（次/秒）"""
+        with self._lock:
+            return self._bucket(host).rate
+
+    def get_stats(self):
+        """各主机的速率快照"""
+        with self._lock:
+            return {
+                host: {'rate': round(bucket.rate, 3), 'throttled': bucket.throttled}
+                for host, bucket in self._buckets.items()
+            }
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_limiter():
+    """获取进程内共享的限速器（同一出口IP上的所有任务共用）"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter()
+        return _shared_limiter
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果缓存 - 参数相同的任务在有效期内直接返回已生成的报告和压缩包清单；
+按最近使用时间淘汰，报告文件总大小不超过磁盘配额
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = os.path.join("weibo_output", "data", "result_cache.sqlite3")
+
+
+def file_signature(path):
+    """[路径, 大小, 修改时间]，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [path, stat.st_size, stat.st_mtime]
+
+
+def unchanged(signature):
+    """文件仍是缓存时的那一份（没有被删除或被后来的任务覆盖）"""
+    return file_signature(signature[0]) == signature
+
+
+def remove_files(signatures):
+    """删除仍未变化的文件（被后来任务覆盖的文件保留），并清理空目录"""
+    for signature in signatures:
+        if unchanged(signature):
+            try:
+                os.remove(signature[0])
+                os.removedirs(os.path.dirname(signature[0]))
+            except OSError:
+                pass
+
+
+class ResultCache:
+    """已完成任务的结果缓存，线程安全，多个进程可共用同一个数据库文件
+
+    每项记录任务结果、压缩包清单和报告文件的签名；文件被删除或覆盖后该项失效。
+    ttl 为有效期（秒，0 表示不缓存）；max_bytes 为报告文件的总大小上限，超出时淘汰最久未用的项。
+    过期、失效或被淘汰的项移除后以其文件签名调用 on_release（默认删除这些文件），
+    文件还被其他地方使用时由 on_release 决定是否保留。
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, ttl=600, max_bytes=1024 * 1024 * 1024, on_release=None):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.on_release = on_release or remove_files
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, package TEXT, files TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._conn.commit()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        """未过期且报告文件未变化时返回 (结果, 压缩包清单)，否则返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, package, files, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            result, package, files, created_at = row
+            files = json.loads(files)
+            expired = time.time() - created_at > self.ttl or not all(unchanged(f) for f in files)
+            if expired:
+                self._remove(key)
+            else:
+                self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        if expired:
+            self.on_release(files)
+            return None
+
+        # 早期版本把没有压缩包存为 JSON 的 null
+        name, members = json.loads(package) if package not in (None, 'null') else (None, [])
+        return json.loads(result), (name, [tuple(member) for member in members])
+
+    def put(self, key, result, package, files):
+        """缓存一个已完成任务；package 为 (文件名, 成员) 或 None，files 为该任务生成的报告文件"""
+        if not self.enabled:
+            return
+        signatures = [sig for sig in (file_signature(path) for path in files) if sig]
+        size = sum(sig[1] for sig in signatures)
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            # 同一个键的旧项（refresh 重新爬取）被取代，同样需要释放
+            replaced = self._conn.execute("SELECT files FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, result, package, files, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False),
+                 json.dumps(package, ensure_ascii=False) if package is not None else None,
+                 json.dumps(signatures, ensure_ascii=False), size, now, now)
+            )
+            released = self._enforce_quota()
+            self._conn.commit()
+        if replaced:
+            released.append(json.loads(replaced[0]))
+        for files in released:
+            self.on_release(files)
+
+    def refs(self, directory):
+        """使用该目录下文件的缓存项数（任务工作区仍被缓存引用时不能清理）"""
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            rows = self._conn.execute("SELECT files FROM results").fetchall()
+        return sum(1 for row in rows if any(sig[0].startswith(prefix) for sig in json.loads(row[0])))
+
+    def _remove(self, key):
+        self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _enforce_quota(self):
+        """移除过期项，再按最近使用时间从旧到新淘汰，直到总大小不超过配额；返回被移除项的文件签名"""
+        released = []
+        for key, files in self._conn.execute(
+            "SELECT key, files FROM results WHERE created_at < ?", (time.time() - self.ttl,)
+        ).fetchall():
+            self._remove(key)
+            released.append(json.loads(files))
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return released
+        for key, files, size in self._conn.execute(
+            "SELECT key, files, size FROM results ORDER BY last_used"
+        ).fetchall():
+            self._remove(key)
+            released.append(json.loads(files))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return released
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
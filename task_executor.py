@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+爬取任务执行器 - 固定数量的工作线程 + 有界等待队列，按客户端限制同时进行的任务数
+"""
+
+import collections
+import threading
+import time
+import traceback
+
+
+class TaskRejected(Exception):
+    """任务未被接受；retry_after 为建议的重试等待秒数"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TaskExecutor:
+    """有界的爬取任务执行器，线程安全
+
+    submit() 在队列已满或该客户端的任务数已达上限时抛出 TaskRejected；
+    position() 返回任务的排队位置：1 表示下一个执行，0 表示正在执行，None 表示已结束或不存在。
+    """
+    def __init__(self, max_workers=2, max_queue=20, max_per_client=2, default_task_seconds=60):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.max_per_client = max(1, max_per_client)
+
+        self._waiting = collections.deque()
+        self._jobs = {}
+        self._running = set()
+        self._client_tasks = collections.Counter()
+        self._cond = threading.Condition()
+        self._threads = []
+
+        # 最近任务的平均耗时，用于估算 Retry-After
+        self._avg_seconds = default_task_seconds
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._worker, name=f"scrape-task-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._waiting:
+                    self._cond.wait()
+                task_id = self._waiting.popleft()
+                client_id, func, args = self._jobs.pop(task_id)
+                self._running.add(task_id)
+
+            start = time.time()
+            try:
+                func(*args)
+            except Exception:  # 任务函数自行记录失败，这里只保证工作线程不退出
+                print(traceback.format_exc())
+            finally:
+                elapsed = time.time() - start
+                with self._cond:
+                    self._running.discard(task_id)
+                    self._client_tasks[client_id] -= 1
+                    if self._client_tasks[client_id] <= 0:
+                        del self._client_tasks[client_id]
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    def _retry_after_locked(self):
+        """按平均耗时估算的重试等待秒数（调用方持有锁）"""
+        backlog = len(self._waiting) + len(self._running)
+        return max(1, int(self._avg_seconds * backlog / self.max_workers))
+
+    def submit(self, task_id, client_id, func, *args):
+        """排队执行 func(*args)，返回排队位置（1 表示下一个执行）"""
+        with self._cond:
+            if self._client_tasks[client_id] >= self.max_per_client:
+                raise TaskRejected(
+                    f"每个客户端最多同时进行 {self.max_per_client} 个任务，请等待已有任务完成",
+                    self._retry_after_locked()
+                )
+            free_workers = self.max_workers - len(self._running)
+            if len(self._waiting) >= self.max_queue + max(0, free_workers):
+                raise TaskRejected(
+                    f"任务队列已满（{self.max_queue} 个），请稍后再试",
+                    self._retry_after_locked()
+                )
+
+            self._ensure_workers()
+            self._jobs[task_id] = (client_id, func, args)
+            self._waiting.append(task_id)
+            self._client_tasks[client_id] += 1
+            self._cond.notify()
+            return len(self._waiting)
+
+    def position(self, task_id):
+        with self._cond:
+            if task_id in self._running:
+                return 0
+            try:
+                return self._waiting.index(task_id) + 1
+            except ValueError:
+                return None
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._waiting),
+                'max_queue': self.max_queue,
+            }
+
+
+class SingleFlight:
+    """合并相同的进行中任务：同一个键同时只有一个任务在排队或执行，线程安全"""
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, task_id):
+        """没有相同的进行中任务时登记 task_id 并返回它，否则返回已有的任务ID"""
+        with self._lock:
+            return self._tasks.setdefault(key, task_id)
+
+    def release(self, key, task_id):
+        """任务结束（或未被接受）后注销，之后的相同请求会启动新任务"""
+        with self._lock:
+            if self._tasks.get(key) == task_id:
+                del self._tasks[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
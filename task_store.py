@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务存储 - 任务进度、结果和压缩包清单；默认保存在进程内，多进程部署时使用SQLite共享
+已结束的任务超过保留时间后清除
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TASK_TTL = 3600
+
+
+class MemoryTaskStore:
+    """进程内任务存储（单进程部署），线程安全
+
+    每个任务: {'status': 进度字典, 'result': 结果或 None, 'package': (文件名, 成员) 或 None,
+    'workspace': 任务文件所在的工作区或 None, 'finished_at': 结束时间或 None}
+    """
+    def __init__(self, ttl=DEFAULT_TASK_TTL):
+        self.ttl = ttl
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id, status, workspace=None):
+        """workspace 为任务读取文件的工作区（使用缓存结果的任务指向原任务的工作区）"""
+        with self._lock:
+            self._tasks[task_id] = {'status': status, 'result': None, 'package': None,
+                                    'workspace': workspace, 'finished_at': None}
+
+    def update_status(self, task_id, status):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task['status'] = status
+
+    def finish(self, task_id, status, result):
+        """保存最终进度和结果（{'success': ..., 'data'/'error': ...}），开始计算保留时间"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task.update(status=status, result=result, finished_at=time.time())
+
+    def get(self, task_id):
+        """{'status', 'result'}，任务不存在时返回 None"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return {'status': task['status'], 'result': task['result']} if task else None
+
+    def set_package(self, task_id, name, members):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task['package'] = (name, list(members))
+
+    def get_package(self, task_id):
+        """已完成任务的压缩包 (文件名, [(压缩包内路径, 本地路径)])，没有时返回 None"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return task['package'] if task else None
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def workspace_refs(self, workspace):
+        """指向该工作区的任务数"""
+        with self._lock:
+            return sum(1 for task in self._tasks.values() if task['workspace'] == workspace)
+
+    def evict_expired(self):
+        """清除结束超过 ttl 秒的任务，返回被清除任务的工作区（可能重复或为 None）"""
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                task_id for task_id, task in self._tasks.items()
+                if task['finished_at'] is not None and task['finished_at'] < deadline
+            ]
+            return [self._tasks.pop(task_id)['workspace'] for task_id in expired]
+
+
+class SQLiteTaskStore:
+    """SQLite任务存储，多个进程（如gunicorn的多个worker）共用同一个数据库文件"""
+    def __init__(self, db_path, ttl=DEFAULT_TASK_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, package TEXT, "
+            "updated_at REAL NOT NULL, finished_at REAL, workspace TEXT)"
+        )
+        try:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN workspace TEXT")
+        except sqlite3.OperationalError:
+            pass  # 已有该列
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_finished_at ON tasks (finished_at)")
+        self._conn.commit()
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, args)
+            self._conn.commit()
+            return cursor
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()
+
+    def create(self, task_id, status, workspace=None):
+        self._execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, updated_at, workspace) VALUES (?, ?, ?, ?)",
+            (task_id, json.dumps(status, ensure_ascii=False), time.time(), workspace)
+        )
+
+    def update_status(self, task_id, status):
+        self._execute(
+            "UPDATE tasks SET status = ?, updated_at = ? WHERE task_id = ?",
+            (json.dumps(status, ensure_ascii=False), time.time(), task_id)
+        )
+
+    def finish(self, task_id, status, result):
+        now = time.time()
+        self._execute(
+            "UPDATE tasks SET status = ?, result = ?, updated_at = ?, finished_at = ? WHERE task_id = ?",
+            (json.dumps(status, ensure_ascii=False), json.dumps(result, ensure_ascii=False), now, now, task_id)
+        )
+
+    def get(self, task_id):
+        row = self._query("SELECT status, result FROM tasks WHERE task_id = ?", (task_id,))
+        if not row:
+            return None
+        return {'status': json.loads(row[0]), 'result': json.loads(row[1]) if row[1] else None}
+
+    def set_package(self, task_id, name, members):
+        self._execute(
+            "UPDATE tasks SET package = ? WHERE task_id = ?",
+            (json.dumps([name, list(members)], ensure_ascii=False), task_id)
+        )
+
+    def get_package(self, task_id):
+        row = self._query("SELECT package FROM tasks WHERE task_id = ?", (task_id,))
+        if not row or not row[0]:
+            return None
+        name, members = json.loads(row[0])
+        return name, [tuple(member) for member in members]
+
+    def delete(self, task_id):
+        self._execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def workspace_refs(self, workspace):
+        return self._query("SELECT COUNT(*) FROM tasks WHERE workspace = ?", (workspace,))[0]
+
+    def evict_expired(self):
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT workspace FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (deadline,)
+            )]
+            self._conn.execute("DELETE FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (deadline,))
+            self._conn.commit()
+        return expired
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_task_store(spec=None, ttl=DEFAULT_TASK_TTL):
+    """按配置创建任务存储：空或 memory 为进程内存储，sqlite:<路径> 为SQLite存储"""
+    spec = spec or 'memory'
+    if spec == 'memory':
+        return MemoryTaskStore(ttl)
+    if spec.startswith('sqlite:'):
+        return SQLiteTaskStore(spec[len('sqlite:'):], ttl)
+    raise ValueError(f"不支持的任务存储: {spec}")
+
+
+class BatchedProgressWriter:
+    """合并高频的进度更新：两次写入存储至少间隔 interval 秒，最后一次更新最迟 interval 秒后写入"""
+    def __init__(self, store, task_id, interval=1.0):
+        self.store = store
+        self.task_id = task_id
+        self.interval = interval
+
+        self._pending = None
+        self._last_write = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def write(self, status):
+        with self._lock:
+            self._pending = status
+            wait = self._last_write + self.interval - time.time()
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def discard(self):
+        """丢弃尚未写入的更新（任务结束时由最终状态取代）"""
+        with self._lock:
+            self._pending = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def flush(self):
+        """立即写入尚未写入的更新"""
+        with self._lock:
+            status, self._pending = self._pending, None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if status is None:
+                return
+            self._last_write = time.time()
+            self.store.update_status(self.task_id, status)
+
+
+class ProgressHub:
+    """进程内的进度通知：本进程执行的任务每次更新都立即通知等待的订阅者（不经过批量写入）"""
+    def __init__(self):
+        self._latest = {}
+        self._cond = threading.Condition()
+
+    def publish(self, task_id, status):
+        with self._cond:
+            version = self._latest.get(task_id, (0, None))[0] + 1
+            self._latest[task_id] = (version, status)
+            self._cond.notify_all()
+
+    def latest(self, task_id):
+        """(版本号, 最新进度)，本进程没有该任务时返回 None"""
+        with self._cond:
+            return self._latest.get(task_id)
+
+    def wait(self, task_id, version, timeout):
+        """等待版本号超过 version 的更新或超时，返回当前版本号（本进程没有该任务时为 None）"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                current = self._latest.get(task_id)
+                if current is None or current[0] > version:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return current[0] if current else None
+
+    def discard(self, task_id):
+        with self._cond:
+            self._latest.pop(task_id, None)
+            self._cond.notify_all()
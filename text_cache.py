@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全文缓存 - statuses/extend 结果按微博ID持久化到SQLite，前面加一层进程内LRU
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_PATH = os.path.join("weibo_output", "data", "long_text_cache.sqlite3")
+
+
+class LongTextCache:
+    """微博全文缓存（保存接口返回的原始 longTextContent），线程安全"""
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, lru_size=2048):
+        self.db_path = db_path
+        self.lru_size = lru_size
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS long_texts ("
+            "weibo_id TEXT PRIMARY KEY, content TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _remember(self, weibo_id, content):
+        self._lru[weibo_id] = content
+        self._lru.move_to_end(weibo_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, weibo_id, task_stats=None):
+        """查询缓存，未命中返回 None
+
+        task_stats: 可选的调用方统计字典，累加 text_cache_hits/text_cache_misses
+        """
+        weibo_id = str(weibo_id)
+        with self._lock:
+            content = self._lru.get(weibo_id)
+            if content is not None:
+                self._lru.move_to_end(weibo_id)
+            else:
+                row = self._conn.execute(
+                    "SELECT content FROM long_texts WHERE weibo_id = ?", (weibo_id,)
+                ).fetchone()
+                if row:
+                    content = row[0]
+                    self._remember(weibo_id, content)
+
+            if task_stats is not None:
+                field = 'text_cache_hits' if content is not None else 'text_cache_misses'
+                task_stats[field] = task_stats.get(field, 0) + 1
+
+        return content
+
+    def put(self, weibo_id, content):
+        """写入缓存"""
+        weibo_id = str(weibo_id)
+        with self._lock:
+            self._remember(weibo_id, content)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO long_texts (weibo_id, content, fetched_at) VALUES (?, ?, ?)",
+                (weibo_id, content, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def hit_ratio(task_stats):
+    """根据统计字典计算缓存命中率（0~1）"""
+    hits = task_stats.get('text_cache_hits', 0)
+    total = hits + task_stats.get('text_cache_misses', 0)
+    return hits / total if total else 0.0
+
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_text_cache(db_path=DEFAULT_CACHE_PATH):
+    """按数据库路径获取进程内共享的缓存实例"""
+    key = os.path.abspath(db_path)
+    with _shared_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = LongTextCache(db_path)
+            _shared_caches[key] = cache
+        return cache
@@ -4,20 +4,139 @@
 Web版微博爬虫 - 支持关键词搜索和Web界面
 """
 
-import ssl
-import urllib.request
+import asyncio
+import hashlib
 import json
 import re
 import os
 import glob
 from datetime import datetime
-import time
-import zipfile
 import base64
+from http_client import ACCEPT_ENCODING, get_shared_client
+from crawl_engine import AsyncCrawlEngine
+from image_pool import ByteBudget, ImageDownloadPool
+from image_store import IMAGE_QUALITIES, TaskImageManifest, get_shared_image_store, select_pic_url, variant_url
+from image_derivatives import derivatives_available, get_shared_derivatives
+from packager import build_package
+from text_cache import get_shared_text_cache, hit_ratio
+from crawl_state import CrawlStateStore
+
+
+API_HOST = 'm.weibo.cn'
+
+
+# HTML报告的头部和尾部（正文在两者之间流式写入）
+HTML_REPORT_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        body {{
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'PingFang SC', sans-serif;
+            line-height: 1.6;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #fff;
+        }}
+        h1 {{ color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px; }}
+        h2 {{ color: #34495e; margin-top: 30px; }}
+        h3 {{ color: #7f8c8d; margin-top: 25px; }}
+        .weibo-content {{ 
+            background-color: #f8f9fa; 
+            padding: 15px; 
+            border-radius: 8px; 
+            margin: 15px 0;
+            border-left: 4px solid #3498db;
+        }}
+        .weibo-meta {{ 
+            color: #7f8c8d; 
+            font-size: 0.9em; 
+            margin-bottom: 10px;
+        }}
+        .weibo-text {{ 
+            margin: 15px 0; 
+            white-space: pre-line;
+        }}
+        .retweet {{ 
+            background-color: #ecf0f1; 
+            padding: 10px; 
+            border-radius: 5px; 
+            margin: 10px 0;
+            border-left: 3px solid #95a5a6;
+        }}
+        .stats {{ 
+            background-color: #fff; 
+            padding: 10px; 
+            border-radius: 5px; 
+            border: 1px solid #bdc3c7;
+            margin-top: 15px;
+        }}
+        .stats ul {{ margin: 0; padding-left: 20px; }}
+        img {{ 
+            max-width: 100%; 
+            height: auto; 
+            border-radius: 8px; 
+            margin: 10px 0;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+        }}
+        hr {{ border: none; border-top: 1px solid #ecf0f1; margin: 30px 0; }}
+        .summary {{ 
+            background-color: #e8f5e8; 
+            padding: 15px; 
+            border-radius: 8px; 
+            margin: 20px 0;
+        }}
+        blockquote {{ 
+            margin: 0; 
+            padding-left: 15px; 
+            color: #7f8c8d;
+        }}
+    </style>
+</head>
+<body>
+"""
+
+HTML_REPORT_TAIL = """
+</body>
+</html>"""
+
+
+# HTML报告中图片的呈现方式：嵌入base64 / 链接报告旁的图片文件
+REPORT_IMAGE_MODES = ('embed', 'linked')
+
+# 报告中图片的尺寸：限宽800px的显示图（点击查看原图）/ 原图
+REPORT_IMAGE_SIZES = ('display', 'original')
+
+# Web接口可设置的全文、图片并发数上限（请求参数直接决定线程数，需要限制）
+MAX_WEB_TEXT_CONCURRENCY = 8
+MAX_WEB_IMAGE_CONCURRENCY = 12
+
+# base64分块编码时每次读取的字节数（3的倍数，块之间不会产生填充）
+BASE64_CHUNK_SIZE = 48 * 1024
+
+
+def write_base64_image(f, image_path, mime, alt):
+    """把图片分块编码为base64，直接写入HTML文件；图片无法读取时返回 False"""
+    try:
+        src = open(image_path, 'rb')
+    except OSError:
+        return False
+    with src:
+        f.write(f'<img src="data:{mime};base64,')
+        for chunk in iter(lambda: src.read(BASE64_CHUNK_SIZE), b''):
+            f.write(base64.b64encode(chunk).decode('ascii'))
+        f.write(f'" alt="{alt}" />\n')
+    return True
 
 
 class WebWeiboScraper:
-    def __init__(self, user_id, user_name, start_date, end_date, keywords=None, max_pages=10, request_delay=2, output_dir="weibo_output"):
+    def __init__(self, user_id, user_name, start_date, end_date, keywords=None, max_pages=10, request_delay=2, output_dir="weibo_output",
+                 text_concurrency=4, image_concurrency=6, incremental=False, max_image_bytes=None, max_task_image_bytes=None,
+                 report_image_mode='embed', report_image_size='display', image_quality='large', package=None,
+                 workspace_dir=None):
         # 基本配置
         self.user_id = user_id
         self.user_name = user_name
@@ -27,34 +146,102 @@ class WebWeiboScraper:
         self.max_pages = max_pages
         self.request_delay = request_delay
         self.output_dir = output_dir
+        # 任务工作区：报告、图片清单和压缩包只写在这里；图片库和缓存在 output_dir 下各任务共用
+        self.workspace_dir = workspace_dir or output_dir
+        
+        # 全文请求并发上限
+        self.text_concurrency = text_concurrency
+        
+        # 共享HTTP客户端（按主机复用keep-alive连接，自适应限速）
+        self.http = get_shared_client()
+        if request_delay and self.http.rate_limiter:
+            self.http.rate_limiter.configure(API_HOST, 1 / request_delay)
         
-        # SSL设置
-        self.ssl_context = ssl.create_default_context()
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_NONE
         
         # HTTP请求头
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15',
             'Accept': 'application/json, text/plain, */*',
+            'Accept-Encoding': ACCEPT_ENCODING,
             'Referer': f'https://m.weibo.cn/u/{self.user_id}',
         }
         
         # 创建输出目录
-        self.reports_dir = os.path.join(self.output_dir, "reports")
+        self.reports_dir = os.path.join(self.workspace_dir, "reports")
         self.images_dir = os.path.join(self.output_dir, "images")
         self.data_dir = os.path.join(self.output_dir, "data")
+        # 报告引用图片的相对路径（工作区可能在 tasks/<任务ID>/ 下）；
+        # 压缩包内保持与输出目录相同的结构，同一个相对路径在磁盘上和压缩包内都可用
+        self.report_images_href = os.path.relpath(self.images_dir, self.reports_dir).replace(os.sep, '/')
+        self.reports_arcdir = os.path.relpath(self.reports_dir, self.output_dir).replace(os.sep, '/')
         
-        for directory in [self.output_dir, self.reports_dir, self.images_dir, self.data_dir]:
+        for directory in [self.output_dir, self.workspace_dir, self.reports_dir, self.images_dir, self.data_dir]:
             os.makedirs(directory, exist_ok=True)
         
+        # 内容寻址图片库：同一张图只下载、保存一份，清单记录每条微博的图片
+        self.image_store = get_shared_image_store(self.images_dir, os.path.join(self.data_dir, "image_manifest.sqlite3"))
+        
+        # 图片下载池（爬取流程只排队，不等待），单张图片和整个任务都可设字节上限
+        self.image_pool = ImageDownloadPool(
+            max_workers=image_concurrency, max_image_bytes=max_image_bytes, image_store=self.image_store
+        )
+        self.image_budget = ByteBudget(max_task_image_bytes)
+        self.image_futures = {}
+        
+        # 下载哪种清晰度的图片（thumbnail/bmiddle/large，none 为不下载图片）
+        self.image_quality = image_quality if image_quality in IMAGE_QUALITIES else 'large'
+        
+        # 本任务的图片清单（下载完成时记录），报告和压缩包只读清单
+        self.image_manifest = TaskImageManifest()
+        
+        # 报告图片的呈现方式和尺寸；显示图按内容哈希缓存，所有任务共用
+        self.report_image_mode = report_image_mode if report_image_mode in REPORT_IMAGE_MODES else 'embed'
+        self.report_image_size = report_image_size if report_image_size in REPORT_IMAGE_SIZES else 'display'
+        if self.report_image_size == 'display' and not derivatives_available():
+            print("⚠️ 未安装Pillow，报告使用原图")
+            self.report_image_size = 'original'
+        self.derivatives = get_shared_derivatives(self.images_dir) if self.report_image_size == 'display' else None
+        
+        # 流式压缩包：图片下载完成、报告生成后逐个加入，下载方边收边打包（None 时生成压缩包文件）
+        self.package = package
+        if self.package is not None and self.package.name is None:
+            self.package.name = f"{self.package_name()}.zip"
+        
+        # 全文缓存（跨任务持久化）
+        self.text_cache = get_shared_text_cache(os.path.join(self.data_dir, "long_text_cache.sqlite3"))
+        
+        # 增量爬取：按用户归档，遇到高水位线即停止翻页
+        self.incremental = incremental
+        self.state_store = CrawlStateStore(self.data_dir)
+        self.archive = None
+        self.use_high_water = False
+        self.new_records = {}
+        
+        # 本次爬取的覆盖情况（用于更新归档）
+        self.walked_past_start = False
+        self.oldest_seen = None
+        self.stop_reason = None
+        
         # 统计信息
         self.stats = {
             'total_weibos': 0,
             'filtered_weibos': 0,
             'images_downloaded': 0,
             'keyword_matches': 0,
-            'pages_processed': 0
+            'pages_processed': 0,
+            'pool_hits': 0,
+            'pool_misses': 0,
+            'image_bytes': 0,
+            'images_failed': 0,
+            'images_oversized': 0,
+            'images_deduplicated': 0,
+            'text_cache_hits': 0,
+            'text_cache_misses': 0,
+            'archived_weibos': 0,
+            'wire_bytes': 0,
+            'decoded_bytes': 0,
+            'package_bytes': 0,
+            'package_seconds': 0
         }
 
     def format_chinese_date(self, date_str):
@@ -69,6 +256,25 @@ class WebWeiboScraper:
         except:
             return date_str
 
+    def parse_created_at(self, date_str):
+        """解析微博时间，无法解析时返回 None"""
+        try:
+            if any(day in date_str for day in ['Thu', 'Fri', 'Mon', 'Tue', 'Wed', 'Sat', 'Sun']):
+                date_str = re.sub(r'\s+\+\d{4}', '', date_str)
+                return datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
+        except:
+            pass
+        return None
+
+    def is_pinned(self, mblog):
+        """是否为置顶微博（置顶微博可能很旧，不能用于判断翻页位置）"""
+        return bool(mblog.get('isTop')) or mblog.get('title', {}).get('text') == '置顶'
+
+    def date_window(self):
+        """时间范围 (开始, 结束)，与 is_in_date_range 的判断一致"""
+        return (datetime.strptime(self.start_date, '%Y-%m-%d'),
+                datetime.strptime(self.end_date, '%Y-%m-%d'))
+
     def is_in_date_range(self, date_str):
         """检查日期是否在指定范围内"""
         try:
@@ -115,204 +321,271 @@ class WebWeiboScraper:
 
     def get_full_text(self, weibo_id):
         """获取微博全文"""
+        cached = self.text_cache.get(weibo_id, self.stats)
+        if cached is not None:
+            return self.clean_html(cached)
+        
         full_text_url = f"https://m.weibo.cn/statuses/extend?id={weibo_id}"
         try:
-            req = urllib.request.Request(full_text_url, headers=self.headers)
-            response = urllib.request.urlopen(req, timeout=15, context=self.ssl_context)
+            response = self.fetch(full_text_url)
             content = response.read().decode('utf-8')
             data = json.loads(content)
             if data.get('ok') == 1:
                 full_text = data.get('data', {}).get('longTextContent', '')
                 if full_text:
+                    self.text_cache.put(weibo_id, full_text)
                     return self.clean_html(full_text)
+            else:
+                self.http.report_throttle(full_text_url)
         except Exception as e:
             print(f"获取全文失败: {e}")
         return None
 
+    def image_count(self):
+        """本任务得到的图片数"""
+        return len(self.image_manifest)
+
+    def record_image(self, image_path, image_url, weibo_id, image_index):
+        """下载完成时把图片记入本任务的清单"""
+        info = self.image_store.describe(image_url)
+        if info is None:
+            return
+        retweet = str(image_index).startswith('rt_')
+        index = int(str(image_index).rsplit('_', 1)[-1])
+        self.image_manifest.record(weibo_id, index, retweet, info['blob'], info['size'], info['mime'], image_url)
+        if self.package is not None:
+            name = self.report_image_name({'path': info['blob']})
+            self.package.add(f"images/{name}", self.image_store.blob_path(name))
+
+    def queue_image(self, image_url, weibo_id, image_index):
+        """把图片交给下载池，立即返回 Future"""
+        future = self.image_pool.submit(
+            image_url, headers=self.headers, task_stats=self.stats, budget=self.image_budget,
+            on_done=lambda path: self.record_image(path, image_url, weibo_id, image_index)
+        )
+        self.image_futures.setdefault(weibo_id, []).append(future)
+        return future
+
     def download_image(self, image_url, weibo_id, image_index):
-        """下载图片"""
-        try:
-            if '.jpg' in image_url:
-                ext = 'jpg'
-            elif '.png' in image_url:
-                ext = 'png'
-            elif '.gif' in image_url:
-                ext = 'gif'
+        """下载图片（同步等待下载池完成）"""
+        return self.queue_image(image_url, weibo_id, image_index).result()
+
+    def wait_for_images(self, weibos):
+        """只等待给定微博的图片下载完成"""
+        futures = []
+        for weibo in weibos:
+            futures.extend(self.image_futures.get(weibo.get('id', ''), []))
+        self.image_pool.wait(futures)
+
+    def fetch(self, url, timeout=15):
+        """通过共享客户端发送请求"""
+        return self.http.get(url, headers=self.headers, timeout=timeout, task_stats=self.stats)
+
+    def compression_saving(self):
+        """压缩节省的流量比例（0~1）"""
+        decoded = self.stats['decoded_bytes']
+        return 1 - self.stats['wire_bytes'] / decoded if decoded else 0.0
+
+    def current_rate(self):
+        """微博接口当前的请求速率（次/秒）"""
+        return self.http.get_rate(f"https://{API_HOST}/") or 0
+
+    def build_page_url(self, page):
+        """微博列表接口地址"""
+        return f"https://m.weibo.cn/api/container/getIndex?type=uid&value={self.user_id}&containerid=107603{self.user_id}&page={page}"
+
+    def needs_full_text(self, mblog, clean_text):
+        """是否需要请求全文接口"""
+        return mblog.get('isLongText', False) or '全文' in clean_text
+
+    def build_weibo_data(self, mblog, clean_text, rt_text=None):
+        """组装单条微博的输出数据"""
+        weibo_id = mblog.get('id', '')
+        weibo_data = {
+            'id': weibo_id,
+            'mid': mblog.get('mid', ''),
+            'created_at': mblog.get('created_at', ''),
+            'text': clean_text,
+            'source': self.clean_html(mblog.get('source', '')),
+            'reposts_count': mblog.get('reposts_count', 0),
+            'comments_count': mblog.get('comments_count', 0),
+            'attitudes_count': mblog.get('attitudes_count', 0),
+            'url': f"https://m.weibo.cn/detail/{weibo_id}",
+        }
+
+        if 'pics' in mblog and mblog['pics']:
+            weibo_data['images'] = [
+                pic.get('large', {}).get('url', '') for pic in mblog['pics']
+                if pic.get('large', {}).get('url', '')
+            ]
+
+        if 'retweeted_status' in mblog:
+            rt = mblog['retweeted_status']
+            weibo_data['retweeted'] = {
+                'user_name': rt.get('user', {}).get('screen_name', ''),
+                'text': rt_text if rt_text is not None else self.clean_html(rt.get('text', ''))
+            }
+
+        return weibo_data
+
+    def iter_image_jobs(self, mblog, quality=None):
+        """列出需要下载的图片: (图片地址, 微博ID, 序号)，默认按本任务的清晰度选择图片地址"""
+        quality = quality or self.image_quality
+        weibo_id = mblog.get('id', '')
+        for i, pic in enumerate(mblog.get('pics') or [], 1):
+            url = select_pic_url(pic, quality)
+            if url:
+                yield url, weibo_id, i
+
+        rt = mblog.get('retweeted_status') or {}
+        for i, pic in enumerate(rt.get('pics') or [], 1):
+            url = select_pic_url(pic, quality)
+            if url:
+                yield url, weibo_id, f"rt_{i}"
+
+    def observe_mblog(self, mblog):
+        """记录本次爬取覆盖到的时间位置"""
+        if self.is_pinned(mblog):
+            return
+        dt = self.parse_created_at(mblog.get('created_at', ''))
+        if dt is None:
+            return
+        if dt < self.date_window()[0]:
+            self.walked_past_start = True
+        elif self.is_in_date_range(mblog.get('created_at', '')):
+            if self.oldest_seen is None or dt < self.oldest_seen:
+                self.oldest_seen = dt
+
+    def reached_high_water(self, mblog):
+        """增量模式下该微博是否已归档"""
+        return self.use_high_water and self.archive.is_archived(mblog.get('id', ''))
+
+    def archive_record(self, mblog, weibo_data):
+        """增量模式下记录新爬到的微博（关键词筛选前，便于以后换关键词复用）"""
+        if not self.incremental:
+            return
+        record = dict(weibo_data)
+        # 归档始终记录大图链接，合并时再换成当次任务的清晰度
+        record['image_jobs'] = [list(job) for job in self.iter_image_jobs(mblog, 'large')]
+        record['pinned'] = self.is_pinned(mblog)
+        self.new_records[str(weibo_data['id'])] = record
+
+    def load_archive(self):
+        """读取归档，判断能否按高水位线增量爬取"""
+        self.archive = self.state_store.load(self.user_id)
+        start_dt = datetime.strptime(self.start_date, '%Y-%m-%d')
+        self.use_high_water = self.archive.covers(start_dt)
+        if self.use_high_water:
+            print(f"📌 增量模式：高水位线 {self.archive.high_water_id}（{self.archive.high_water_time}），已归档 {len(self.archive.weibos)} 条")
+        else:
+            print("📌 增量模式：归档未覆盖所选时间范围，本次完整爬取并建立归档")
+
+    def update_archive(self):
+        """把本次新爬到的微博写入归档，并更新高水位线和覆盖范围
+
+        同一用户的其他任务可能已在本任务爬取期间更新了归档，改动合并到最新的归档上。
+        """
+        self.archive = self.state_store.update(self.user_id, self.apply_to_archive)
+
+    def apply_to_archive(self, archive):
+        """把本次爬取的结果合并进 archive（在归档锁内调用）"""
+        archive.weibos.update(self.new_records)
+        
+        if self.stop_reason == 'error':
+            # 爬取中断，覆盖范围不连续，只保存数据
+            return
+        
+        newest = None
+        for weibo_id, record in self.new_records.items():
+            if record.get('pinned'):
+                continue
+            if newest is None or int(weibo_id) > int(newest):
+                newest = weibo_id
+        
+        replace_coverage = False
+        if self.stop_reason != 'high_water':
+            if self.walked_past_start:
+                covered_from = datetime.strptime(self.start_date, '%Y-%m-%d').isoformat()
+            elif self.oldest_seen is not None:
+                covered_from = self.oldest_seen.isoformat()
             else:
-                ext = 'jpg'
-            
-            filename = f"{weibo_id}_{image_index}.{ext}"
-            filepath = os.path.join(self.images_dir, filename)
-            
-            if os.path.exists(filepath):
-                return filepath
-            
-            req = urllib.request.Request(image_url, headers=self.headers)
-            response = urllib.request.urlopen(req, timeout=15, context=self.ssl_context)
+                covered_from = None
+            # 本次从时间窗口的结束处开始爬，覆盖到结束日期
+            covered_to = self.date_window()[1].isoformat()
             
-            with open(filepath, 'wb') as f:
-                f.write(response.read())
-            
-            print(f"✅ 下载图片: {filename}")
-            self.stats['images_downloaded'] += 1
-            return filepath
+            if covered_from:
+                # 新覆盖区间与原归档区间 [covered_from, high_water_time] 相接或重叠时合并，
+                # 否则中间有未爬取的空档，以新区间（连同高水位线）取代原区间
+                if (archive.covered_from and archive.high_water_time
+                        and covered_to >= archive.covered_from and covered_from <= archive.high_water_time):
+                    archive.covered_from = min(covered_from, archive.covered_from)
+                else:
+                    archive.covered_from = covered_from
+                    replace_coverage = True
+        
+        if newest is not None and (replace_coverage or archive.high_water_id is None
+                                   or int(newest) > int(archive.high_water_id)):
+            archive.high_water_id = newest
+            dt = self.parse_created_at(self.new_records[newest].get('created_at', ''))
+            archive.high_water_time = dt.isoformat() if dt else None
+        elif replace_coverage:
+            # 本次没有新微博，无法确定高水位线，原区间作废
+            archive.covered_from = None
+
+    def merge_with_archive(self, weibos):
+        """把新微博与归档中符合条件的旧微博合并（按时间倒序）"""
+        seen = {str(w['id']) for w in weibos}
+        merged = list(weibos)
+        
+        for weibo_id, record in self.archive.weibos.items():
+            if weibo_id in seen:
+                continue
+            if not self.is_in_date_range(record.get('created_at', '')):
+                continue
+            matching_text = record.get('text', '') + " " + record.get('retweeted', {}).get('text', '')
+            if not self.matches_keywords(matching_text):
+                continue
             
-        except Exception as e:
-            print(f"❌ 下载图片失败: {e}")
-            return None
+            weibo = {k: v for k, v in record.items() if k not in ('image_jobs', 'pinned')}
+            merged.append(weibo)
+            # 归档时的清晰度可能与本任务不同，按本任务的清晰度换链接
+            for image_url, image_weibo_id, image_index in record.get('image_jobs', []):
+                image_url = variant_url(image_url, self.image_quality)
+                if image_url:
+                    self.queue_image(image_url, image_weibo_id, image_index)
+            self.stats['archived_weibos'] += 1
+        
+        self.stats['keyword_matches'] += self.stats['archived_weibos']
+        self.stats['filtered_weibos'] += self.stats['archived_weibos']
+        merged.sort(key=lambda w: int(w['id']) if str(w['id']).isdigit() else 0, reverse=True)
+        print(f"📚 合并归档微博 {self.stats['archived_weibos']} 条，共 {len(merged)} 条")
+        return merged
 
     def scrape_weibos(self, progress_callback=None):
-        """爬取微博内容"""
-        all_weibos = []
-        page = 1
-        
+        """爬取微博内容（asyncio引擎，页面/全文/图片请求重叠执行）"""
         print(f"🚀 开始搜集 {self.user_name} 的微博...")
         print(f"📅 时间范围: {self.start_date} 到 {self.end_date}")
         if self.keywords:
             print(f"🔍 关键词筛选: {', '.join(self.keywords)}")
         
-        while page <= self.max_pages:
-            if progress_callback:
-                progress_callback(
-                    int((page - 1) / self.max_pages * 100),
-                    f"正在获取第 {page} 页..."
-                )
-            
-            print(f"\n📖 正在获取第 {page} 页...")
-            
-            # 获取微博列表
-            url = f"https://m.weibo.cn/api/container/getIndex?type=uid&value={self.user_id}&containerid=107603{self.user_id}&page={page}"
-            
-            try:
-                req = urllib.request.Request(url, headers=self.headers)
-                response = urllib.request.urlopen(req, timeout=30, context=self.ssl_context)
-                content = response.read().decode('utf-8')
-                data = json.loads(content)
-                
-                if data.get('ok') != 1:
-                    print(f"❌ 第 {page} 页获取失败")
-                    break
-                
-                cards = data.get('data', {}).get('cards', [])
-                if not cards:
-                    print(f"📝 第 {page} 页没有更多内容")
-                    break
-                
-                page_weibos = 0
-                for card in cards:
-                    if card.get('card_type') == 9:
-                        mblog = card.get('mblog', {})
-                        if mblog:
-                            self.stats['total_weibos'] += 1
-                            
-                            created_at = mblog.get('created_at', '')
-                            
-                            # 检查时间范围
-                            if not self.is_in_date_range(created_at):
-                                continue
-                            
-                            weibo_id = mblog.get('id', '')
-                            
-                            # 获取文本
-                            raw_text = mblog.get('text', '')
-                            clean_text = self.clean_html(raw_text)
-                            
-                            # 检查是否需要获取全文
-                            if mblog.get('isLongText', False) or '全文' in clean_text:
-                                print(f"📝 获取微博 {weibo_id} 的全文...")
-                                full_text = self.get_full_text(weibo_id)
-                                if full_text:
-                                    clean_text = full_text
-                                    print(f"✅ 全文获取成功: {len(full_text)} 字符")
-                            
-                            # 处理转发内容文本（用于关键词匹配）
-                            full_content_for_matching = clean_text
-                            if 'retweeted_status' in mblog:
-                                rt = mblog['retweeted_status']
-                                rt_text = self.clean_html(rt.get('text', ''))
-                                rt_id = rt.get('id', '')
-                                
-                                if rt.get('isLongText', False) or '全文' in rt_text:
-                                    rt_full_text = self.get_full_text(rt_id)
-                                    if rt_full_text:
-                                        rt_text = rt_full_text
-                                
-                                full_content_for_matching += " " + rt_text
-                            
-                            # 关键词筛选
-                            if not self.matches_keywords(full_content_for_matching):
-                                continue
-                            
-                            self.stats['keyword_matches'] += 1
-                            
-                            weibo_data = {
-                                'id': weibo_id,
-                                'mid': mblog.get('mid', ''),
-                                'created_at': created_at,
-                                'text': clean_text,
-                                'source': self.clean_html(mblog.get('source', '')),
-                                'reposts_count': mblog.get('reposts_count', 0),
-                                'comments_count': mblog.get('comments_count', 0),
-                                'attitudes_count': mblog.get('attitudes_count', 0),
-                                'url': f"https://m.weibo.cn/detail/{weibo_id}",
-                            }
-                            
-                            # 处理图片
-                            if 'pics' in mblog and mblog['pics']:
-                                weibo_data['images'] = []
-                                for i, pic in enumerate(mblog['pics'], 1):
-                                    pic_url = pic.get('large', {}).get('url', '')
-                                    if pic_url:
-                                        weibo_data['images'].append(pic_url)
-                                        self.download_image(pic_url, weibo_id, i)
-                            
-                            # 处理转发内容
-                            if 'retweeted_status' in mblog:
-                                rt = mblog['retweeted_status']
-                                rt_text = self.clean_html(rt.get('text', ''))
-                                rt_id = rt.get('id', '')
-                                
-                                if rt.get('isLongText', False) or '全文' in rt_text:
-                                    rt_full_text = self.get_full_text(rt_id)
-                                    if rt_full_text:
-                                        rt_text = rt_full_text
-                                
-                                weibo_data['retweeted'] = {
-                                    'user_name': rt.get('user', {}).get('screen_name', ''),
-                                    'text': rt_text
-                                }
-                                
-                                # 下载转发内容的图片
-                                if 'pics' in rt and rt['pics']:
-                                    for i, pic in enumerate(rt['pics'], 1):
-                                        pic_url = pic.get('large', {}).get('url', '')
-                                        if pic_url:
-                                            self.download_image(pic_url, weibo_id, f"rt_{i}")
-                            
-                            all_weibos.append(weibo_data)
-                            page_weibos += 1
-                            self.stats['filtered_weibos'] += 1
-                
-                print(f"✅ 第 {page} 页获取到 {page_weibos} 条符合条件的微博")
-                
-                if page_weibos == 0:
-                    print("📝 没有更多符合条件的微博")
-                    break
-                
-                self.stats['pages_processed'] = page
-                page += 1
-                
-                if page <= self.max_pages:
-                    time.sleep(self.request_delay)
-                
-            except Exception as e:
-                print(f"❌ 第 {page} 页获取失败: {e}")
-                break
+        if self.incremental:
+            self.load_archive()
+        
+        engine = AsyncCrawlEngine(self, text_concurrency=self.text_concurrency)
+        all_weibos = asyncio.run(engine.run(progress_callback))
+        
+        if self.incremental:
+            self.update_archive()
+            all_weibos = self.merge_with_archive(all_weibos)
         
         print(f"\n🎉 搜集完成！")
         print(f"📊 总共处理了 {self.stats['total_weibos']} 条微博")
         print(f"📊 筛选后得到 {self.stats['filtered_weibos']} 条微博")
-        print(f"📊 下载了 {self.stats['images_downloaded']} 张图片")
+        pool_stats = self.image_pool.get_stats()
+        print(f"📊 图片队列剩余 {pool_stats['queue_depth']} 张，已下载 {self.stats['images_downloaded']} 张，失败 {self.stats['images_failed']} 张，图片库复用 {self.stats['images_deduplicated']} 张，超限跳过 {self.stats['images_oversized']} 张")
+        print(f"📊 连接复用 {self.stats['pool_hits']} 次，新建连接 {self.stats['pool_misses']} 次")
+        print(f"📊 传输流量 {self.stats['wire_bytes'] / 1024:.0f} KB，解压后 {self.stats['decoded_bytes'] / 1024:.0f} KB（节省 {self.compression_saving():.0%}）")
+        print(f"📊 全文缓存命中 {self.stats['text_cache_hits']} 次，未命中 {self.stats['text_cache_misses']} 次（命中率 {hit_ratio(self.stats):.0%}）")
         if self.keywords:
             print(f"📊 关键词匹配 {self.stats['keyword_matches']} 条")
         
@@ -323,6 +596,9 @@ class WebWeiboScraper:
 
     def generate_reports(self, weibos):
         """生成报告文件"""
+        # 报告只需要这些微博的图片
+        self.wait_for_images(weibos)
+        
         print("📝 生成报告文件...")
         
         # 文件名包含时间范围和关键词信息
@@ -339,17 +615,44 @@ class WebWeiboScraper:
         # 生成HTML报告
         self.generate_html_report(weibos, html_filename, md_filename)
         
-        # 创建完整压缩包（包含reports和images文件夹）
-        complete_package = self.create_complete_package(md_filename, html_filename)
+        # 本任务的图片清单
+        manifest_filename = os.path.join(self.workspace_dir, "image_manifest.json")
+        self.image_manifest.save(manifest_filename)
+        
+        if self.package is not None:
+            # 流式压缩包：图片已随下载加入，最后加入报告
+            for arcname, path in self.report_members(md_filename, html_filename):
+                self.package.add(arcname, path)
+            self.package.close()
+            complete_package = None
+        else:
+            # 创建完整压缩包（包含reports和images文件夹）
+            complete_package = self.create_complete_package(md_filename, html_filename)
         
-        return {
+        result = {
             'markdown_file': md_filename,
             'html_file': html_filename,
+            'manifest_file': manifest_filename,
+            'workspace': self.workspace_dir,
             'complete_package': complete_package,
             'weibo_count': len(weibos),
-            'image_count': self.stats['images_downloaded'],
-            'keyword_matches': self.stats['keyword_matches']
+            'image_count': self.image_count(),
+            'keyword_matches': self.stats['keyword_matches'],
+            'pool_hits': self.stats['pool_hits'],
+            'pool_misses': self.stats['pool_misses'],
+            'request_rate': round(self.current_rate(), 2),
+            'text_cache_hit_ratio': round(hit_ratio(self.stats), 3),
+            'archived_weibos': self.stats['archived_weibos'],
+            'wire_bytes': self.stats['wire_bytes'],
+            'decoded_bytes': self.stats['decoded_bytes'],
+            'image_pool': self.image_pool.get_stats(),
+            'preview_images': self.image_manifest.paths()[:12]
         }
+        # 流式压缩包在下载时才生成，大小和耗时此时未知，不报告
+        if complete_package is not None:
+            result['package_bytes'] = self.stats['package_bytes']
+            result['package_seconds'] = self.stats['package_seconds']
+        return result
 
     def generate_markdown_report(self, weibos, filename):
         """生成Markdown报告"""
@@ -363,7 +666,7 @@ class WebWeiboScraper:
             f.write("## 📊 数据统计\n\n")
             f.write(f"- **用户**: {self.user_name}\n")
             f.write(f"- **微博总数**: {len(weibos)} 条\n")
-            f.write(f"- **图片总数**: {self.stats['images_downloaded']} 张\n")
+            f.write(f"- **图片总数**: {self.image_count()} 张\n")
             if self.keywords:
                 f.write(f"- **关键词匹配**: {self.stats['keyword_matches']} 条\n")
             f.write(f"- **报告生成**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
@@ -394,19 +697,15 @@ class WebWeiboScraper:
                         f.write(f"**🔄 转发内容**:\n")
                         f.write(f"> **@{rt.get('user_name', '')}**: {rt.get('text', '')}\n\n")
                     
-                    # 图片展示
-                    if 'images' in weibo and weibo['images']:
-                        for idx, img_url in enumerate(weibo['images'], 1):
-                            weibo_id = weibo.get('id', '')
-                            local_pattern = os.path.join(self.images_dir, f"{weibo_id}_{idx}.jpg")
-                            if os.path.exists(local_pattern):
-                                relative_path = f"../images/{weibo_id}_{idx}.jpg"
-                                f.write(f"![图片{idx}]({relative_path})\n\n")
-                            
-                            rt_pattern = os.path.join(self.images_dir, f"{weibo_id}_rt_{idx}.jpg")
-                            if os.path.exists(rt_pattern):
-                                relative_rt_path = f"../images/{weibo_id}_rt_{idx}.jpg"
-                                f.write(f"![转发图片{idx}]({relative_rt_path})\n\n")
+                    # 图片展示（按本任务的图片清单）
+                    for image in self.image_manifest.images(weibo.get('id', '')):
+                        label = f"转发图片{image['index']}" if image['retweet'] else f"图片{image['index']}"
+                        name = self.report_image_name(image)
+                        href = self.original_image_href(image, name)
+                        if href:
+                            f.write(f"[![{label}]({self.report_images_href}/{name})]({href})\n\n")
+                        else:
+                            f.write(f"![{label}]({self.report_images_href}/{name})\n\n")
                     
                     # 互动数据
                     f.write(f"**📊 互动数据**:\n")
@@ -422,236 +721,211 @@ class WebWeiboScraper:
         print(f"✅ Markdown报告已生成: {filename}")
 
     def generate_html_report(self, weibos, html_filename, md_filename):
-        """生成HTML报告，图片以base64嵌入"""
+        """生成HTML报告，图片按 report_image_mode 以base64嵌入或链接图片文件
+
+        边渲染边写入文件，内存占用不随微博数和图片数增长。
+        """
         print(f"📝 生成HTML报告: {html_filename}")
         
-        def image_to_base64(image_path):
-            """将图片转换为base64编码"""
-            try:
-                with open(image_path, 'rb') as f:
-                    return base64.b64encode(f.read()).decode('utf-8')
-            except:
-                return None
+        title = f"{self.user_name} - 微博内容报告 ({self.start_date} 至 {self.end_date})"
         
-        # HTML模板
-        html_template = """<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title}</title>
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'PingFang SC', sans-serif;
-            line-height: 1.6;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #fff;
-        }}
-        h1 {{ color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px; }}
-        h2 {{ color: #34495e; margin-top: 30px; }}
-        h3 {{ color: #7f8c8d; margin-top: 25px; }}
-        .weibo-content {{ 
-            background-color: #f8f9fa; 
-            padding: 15px; 
-            border-radius: 8px; 
-            margin: 15px 0;
-            border-left: 4px solid #3498db;
-        }}
-        .weibo-meta {{ 
-            color: #7f8c8d; 
-            font-size: 0.9em; 
-            margin-bottom: 10px;
-        }}
-        .weibo-text {{ 
-            margin: 15px 0; 
-            white-space: pre-line;
-        }}
-        .retweet {{ 
-            background-color: #ecf0f1; 
-            padding: 10px; 
-            border-radius: 5px; 
-            margin: 10px 0;
-            border-left: 3px solid #95a5a6;
-        }}
-        .stats {{ 
-            background-color: #fff; 
-            padding: 10px; 
-            border-radius: 5px; 
-            border: 1px solid #bdc3c7;
-            margin-top: 15px;
-        }}
-        .stats ul {{ margin: 0; padding-left: 20px; }}
-        img {{ 
-            max-width: 100%; 
-            height: auto; 
-            border-radius: 8px; 
-            margin: 10px 0;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        }}
-        hr {{ border: none; border-top: 1px solid #ecf0f1; margin: 30px 0; }}
-        .summary {{ 
-            background-color: #e8f5e8; 
-            padding: 15px; 
-            border-radius: 8px; 
-            margin: 20px 0;
-        }}
-        blockquote {{ 
-            margin: 0; 
-            padding-left: 15px; 
-            color: #7f8c8d;
-        }}
-    </style>
-</head>
-<body>
-{content}
-</body>
-</html>"""
+        with open(html_filename, 'w', encoding='utf-8') as f:
+            f.write(HTML_REPORT_HEAD.format(title=title))
+            
+            f.write(f"<h1>{self.user_name} - 微博内容报告</h1>\n")
+            f.write(f"<p><strong>时间范围</strong>: {self.start_date} 至 {self.end_date}</p>\n")
+            if self.keywords:
+                f.write(f"<p><strong>关键词筛选</strong>: {', '.join(self.keywords)}</p>\n")
+            f.write("\n")
+            
+            f.write("<h2>📊 数据统计</h2>\n")
+            f.write("<ul>\n")
+            f.write(f"<li><strong>用户</strong>: {self.user_name}</li>\n")
+            f.write(f"<li><strong>微博总数</strong>: {len(weibos)} 条</li>\n")
+            f.write(f"<li><strong>图片总数</strong>: {self.image_count()} 张</li>\n")
+            if self.keywords:
+                f.write(f"<li><strong>关键词匹配</strong>: {self.stats['keyword_matches']} 条</li>\n")
+            f.write(f"<li><strong>报告生成</strong>: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</li>\n")
+            f.write("</ul>\n")
+            
+            f.write("<hr>\n")
+            
+            if weibos:
+                f.write("<h2>📝 微博内容 (完整版)</h2>\n")
+                for i, weibo in enumerate(weibos, 1):
+                    self.write_html_weibo(f, i, weibo)
+            
+            f.write(HTML_REPORT_TAIL)
         
-        # 生成HTML内容
-        html_content = f"<h1>{self.user_name} - 微博内容报告</h1>\n"
-        html_content += f"<p><strong>时间范围</strong>: {self.start_date} 至 {self.end_date}</p>\n"
-        if self.keywords:
-            html_content += f"<p><strong>关键词筛选</strong>: {', '.join(self.keywords)}</p>\n"
-        html_content += "\n"
-        
-        html_content += "<h2>📊 数据统计</h2>\n"
-        html_content += "<ul>\n"
-        html_content += f"<li><strong>用户</strong>: {self.user_name}</li>\n"
-        html_content += f"<li><strong>微博总数</strong>: {len(weibos)} 条</li>\n"
-        html_content += f"<li><strong>图片总数</strong>: {self.stats['images_downloaded']} 张</li>\n"
-        if self.keywords:
-            html_content += f"<li><strong>关键词匹配</strong>: {self.stats['keyword_matches']} 条</li>\n"
-        html_content += f"<li><strong>报告生成</strong>: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</li>\n"
-        html_content += "</ul>\n"
+        print(f"✅ HTML报告已生成: {html_filename}")
+
+    def write_html_weibo(self, f, i, weibo):
+        """把一条微博的HTML片段写入文件"""
+        f.write(f"<h3>微博 {i}</h3>\n")
+        f.write("<div class='weibo-content'>\n")
         
-        html_content += "<hr>\n"
+        # 基本信息
+        created_at = weibo.get('created_at', '')
+        chinese_date = self.format_chinese_date(created_at)
+        f.write(f"<p class='weibo-meta'><strong>🕒 发布时间</strong>: {chinese_date}</p>\n")
+        f.write(f"<p class='weibo-meta'><strong>🔗 微博链接</strong>: <a href='{weibo.get('url', '')}' target='_blank'>{weibo.get('url', '')}</a></p>\n")
+        f.write(f"<p class='weibo-meta'><strong>🆔 微博ID</strong>: {weibo.get('id', '')}</p>\n")
         
-        if weibos:
-            html_content += "<h2>📝 微博内容 (完整版)</h2>\n"
-            
-            for i, weibo in enumerate(weibos, 1):
-                html_content += f"<h3>微博 {i}</h3>\n"
-                html_content += "<div class='weibo-content'>\n"
-                
-                # 基本信息
-                created_at = weibo.get('created_at', '')
-                chinese_date = self.format_chinese_date(created_at)
-                html_content += f"<p class='weibo-meta'><strong>🕒 发布时间</strong>: {chinese_date}</p>\n"
-                html_content += f"<p class='weibo-meta'><strong>🔗 微博链接</strong>: <a href='{weibo.get('url', '')}' target='_blank'>{weibo.get('url', '')}</a></p>\n"
-                html_content += f"<p class='weibo-meta'><strong>🆔 微博ID</strong>: {weibo.get('id', '')}</p>\n"
-                
-                # 完整内容
-                text = weibo.get('text', '').strip()
-                if text:
-                    html_content += f"<div class='weibo-text'><strong>📄 完整内容</strong>:<br>{text}</div>\n"
-                
-                # 转发内容
-                if 'retweeted' in weibo:
-                    rt = weibo['retweeted']
-                    html_content += "<div class='retweet'>\n"
-                    html_content += f"<strong>🔄 转发内容</strong>:<br>\n"
-                    html_content += f"<blockquote><strong>@{rt.get('user_name', '')}</strong>: {rt.get('text', '')}</blockquote>\n"
-                    html_content += "</div>\n"
-                
-                # 图片展示（base64嵌入）
-                if 'images' in weibo and weibo['images']:
-                    for idx, img_url in enumerate(weibo['images'], 1):
-                        weibo_id = weibo.get('id', '')
-                        local_pattern = os.path.join(self.images_dir, f"{weibo_id}_{idx}.jpg")
-                        if os.path.exists(local_pattern):
-                            base64_data = image_to_base64(local_pattern)
-                            if base64_data:
-                                html_content += f'<img src="data:image/jpeg;base64,{base64_data}" alt="图片{idx}" />\n'
-                        
-                        # 检查转发图片
-                        rt_pattern = os.path.join(self.images_dir, f"{weibo_id}_rt_{idx}.jpg")
-                        if os.path.exists(rt_pattern):
-                            base64_data = image_to_base64(rt_pattern)
-                            if base64_data:
-                                html_content += f'<img src="data:image/jpeg;base64,{base64_data}" alt="转发图片{idx}" />\n'
-                
-                # 互动数据
-                html_content += "<div class='stats'>\n"
-                html_content += "<strong>📊 互动数据</strong>:\n"
-                html_content += "<ul>\n"
-                html_content += f"<li>🔄 转发: {weibo.get('reposts_count', 0):,}</li>\n"
-                html_content += f"<li>💬 评论: {weibo.get('comments_count', 0):,}</li>\n"
-                html_content += f"<li>❤️ 点赞: {weibo.get('attitudes_count', 0):,}</li>\n"
-                if weibo.get('source'):
-                    html_content += f"<li>📱 来源: {weibo.get('source', '')}</li>\n"
-                html_content += "</ul>\n"
-                html_content += "</div>\n"
-                
-                html_content += "</div>\n"
-                html_content += "<hr>\n"
+        # 完整内容
+        text = weibo.get('text', '').strip()
+        if text:
+            f.write(f"<div class='weibo-text'><strong>📄 完整内容</strong>:<br>{text}</div>\n")
         
-        # 生成最终HTML
-        title = f"{self.user_name} - 微博内容报告 ({self.start_date} 至 {self.end_date})"
-        final_html = html_template.format(title=title, content=html_content)
+        # 转发内容
+        if 'retweeted' in weibo:
+            rt = weibo['retweeted']
+            f.write("<div class='retweet'>\n")
+            f.write(f"<strong>🔄 转发内容</strong>:<br>\n")
+            f.write(f"<blockquote><strong>@{rt.get('user_name', '')}</strong>: {rt.get('text', '')}</blockquote>\n")
+            f.write("</div>\n")
         
-        # 写入HTML文件
-        with open(html_filename, 'w', encoding='utf-8') as f:
-            f.write(final_html)
+        # 图片展示（按本任务的图片清单）
+        for image in self.image_manifest.images(weibo.get('id', '')):
+            label = f"转发图片{image['index']}" if image['retweet'] else f"图片{image['index']}"
+            self.write_html_image(f, image, label)
         
-        print(f"✅ HTML报告已生成: {html_filename}")
+        # 互动数据
+        f.write("<div class='stats'>\n")
+        f.write("<strong>📊 互动数据</strong>:\n")
+        f.write("<ul>\n")
+        f.write(f"<li>🔄 转发: {weibo.get('reposts_count', 0):,}</li>\n")
+        f.write(f"<li>💬 评论: {weibo.get('comments_count', 0):,}</li>\n")
+        f.write(f"<li>❤️ 点赞: {weibo.get('attitudes_count', 0):,}</li>\n")
+        if weibo.get('source'):
+            f.write(f"<li>📱 来源: {weibo.get('source', '')}</li>\n")
+        f.write("</ul>\n")
+        f.write("</div>\n")
+        
+        f.write("</div>\n")
+        f.write("<hr>\n")
+
+    def report_image_name(self, image):
+        """报告中使用的图片文件名（相对 images 目录）：默认为显示图，没有显示图时为原图"""
+        if self.derivatives is None:
+            return image['path']
+        return self.derivatives.display_name(image['path']) or image['path']
+
+    def original_image_href(self, image, name):
+        """报告使用显示图时，点击跳转到的原图（大图）链接；使用原图时返回 None"""
+        return variant_url(image['url'], 'large') if name != image['path'] else None
+
+    def write_html_image(self, f, image, label):
+        """按报告图片模式写入一张图片，使用显示图时外包原图链接"""
+        name = self.report_image_name(image)
+        href = self.original_image_href(image, name)
+        if href:
+            f.write(f'<a href="{href}" target="_blank" rel="noreferrer">')
+        
+        if self.report_image_mode == 'embed':
+            mime = 'image/jpeg' if href else image['mime']
+            write_base64_image(f, self.image_store.blob_path(name), mime, label)
+        else:
+            # 链接模式：引用图片库 images/ 中的文件，浏览器滚动到附近时才加载
+            f.write(f'<img src="{self.report_images_href}/{name}" alt="{label}" loading="lazy" decoding="async" />\n')
+        
+        if href:
+            f.write('</a>\n')
+
+    def report_image_paths(self):
+        """报告实际引用的图片文件（去重），压缩包只需要这些"""
+        return sorted({self.report_image_name(image) for image in self.image_manifest.entries()})
+
+    def package_name(self):
+        """压缩包文件名（不含扩展名）"""
+        return f"{self.user_name}_{self.start_date.replace('-', '')}-{self.end_date.replace('-', '')}"
+
+    def report_members(self, md_filename, html_filename):
+        """压缩包中的报告: [(压缩包内路径, 本地路径)]"""
+        return [
+            (f"{self.reports_arcdir}/{os.path.basename(filename)}", filename)
+            for filename in (md_filename, html_filename) if os.path.exists(filename)
+        ]
+
+    def package_members(self, md_filename, html_filename):
+        """压缩包内容: [(压缩包内路径, 本地路径)]
+
+        报告和图片按在输出目录中的位置存放（报告在 reports/ 或 tasks/<任务ID>/reports/，图片在 images/），
+        报告中的图片相对路径在压缩包内直接可用。
+        图片只取本任务清单中报告引用的那些（默认为显示图）。
+        """
+        members = self.report_members(md_filename, html_filename)
+        for image_path in self.report_image_paths():
+            members.append((f"images/{image_path}", self.image_store.blob_path(image_path)))
+        return members
 
     def create_complete_package(self, md_filename, html_filename):
-        """创建完整的结果压缩包，包含reports和images文件夹"""
-        package_name = f"{self.user_name}_{self.start_date.replace('-', '')}-{self.end_date.replace('-', '')}"
-        zip_filename = os.path.join(self.output_dir, f"{package_name}.zip")
+        """创建完整的结果压缩包，包含reports和本任务用到的images"""
+        zip_filename = os.path.join(self.workspace_dir, f"{self.package_name()}.zip")
         
         print(f"📦 创建完整压缩包: {zip_filename}")
         
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # 添加reports文件夹
-            if os.path.exists(md_filename):
-                arcname = f"reports/{os.path.basename(md_filename)}"
-                zipf.write(md_filename, arcname)
-                print(f"   📄 添加Markdown报告: {arcname}")
-            
-            if os.path.exists(html_filename):
-                arcname = f"reports/{os.path.basename(html_filename)}"
-                zipf.write(html_filename, arcname)
-                print(f"   📄 添加HTML报告: {arcname}")
-            
-            # 添加images文件夹
-            if os.path.exists(self.images_dir):
-                for root, dirs, files in os.walk(self.images_dir):
-                    for file in files:
-                        if file.endswith(('.jpg', '.png', '.gif', '.webp')):
-                            file_path = os.path.join(root, file)
-                            # 使用相对路径，保持images/文件名格式
-                            arcname = f"images/{file}"
-                            zipf.write(file_path, arcname)
-                
-                print(f"   🖼️ 添加图片文件: {self.stats['images_downloaded']} 张")
-            
-            # 修复报告中的图片路径为相对路径
-            self.fix_image_paths_in_zip(zipf, md_filename, html_filename)
+        members = self.package_members(md_filename, html_filename)
+        image_total = sum(1 for arcname, _ in members if arcname.startswith('images/'))
+        print(f"   📄 添加报告: {len(members) - image_total} 个")
+        print(f"   🖼️ 添加图片文件: {image_total} 张（原样存储，不再压缩）")
         
-        print(f"✅ 完整压缩包已生成: {zip_filename}")
-        return zip_filename
-    
-    def fix_image_paths_in_zip(self, zipf, md_filename, html_filename):
-        """修复压缩包中报告文件的图片路径"""
-        # 修复Markdown文件中的图片路径
-        if os.path.exists(md_filename):
-            with open(md_filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 将相对路径改为压缩包内的路径
-            content = re.sub(r'!\[(.*?)\]\(\.\./images/(.*?\.jpg)\)', r'![\1](images/\2)', content)
-            
-            # 写入修复后的文件到压缩包
-            zipf.writestr(f"reports/{os.path.basename(md_filename)}", content)
+        package = build_package(zip_filename, members)
+        self.stats['package_bytes'] = package['size']
+        self.stats['package_seconds'] = package['seconds']
         
-        # 注意：HTML文件使用base64嵌入图片，不需要修复路径
+        print(f"✅ 完整压缩包已生成: {zip_filename}（{package['size'] / 1024 / 1024:.1f} MB，用时 {package['seconds']:.2f} 秒）")
+        return zip_filename
+
+def mb_to_bytes(value):
+    """把以MB为单位的参数转换为字节数，未设置时返回 None"""
+    if not value:
+        return None
+    return int(float(value) * 1024 * 1024)
+
+
+def bounded_int(value, default, maximum):
+    """把请求参数转换为 1..maximum 之间的整数，无法转换时使用默认值"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(value, 1), maximum)
 
 
-def scrape_weibo_web(params, progress_callback=None):
-    """Web接口调用的爬虫函数"""
+def normalize_scrape_params(params):
+    """决定任务输出的参数（规范化后），相同的结果说明两个任务的报告和压缩包相同
+
+    关键词按不区分大小写、去重、排序处理；请求间隔、并发数只影响速度，不计入。
+    """
+    keywords = sorted({str(k).strip().lower() for k in params.get('keywords') or [] if str(k).strip()})
+    return {
+        'userId': str(params.get('userId', '')).strip(),
+        'userName': str(params.get('userName', '')).strip(),
+        'startDate': str(params.get('startDate', '')).strip(),
+        'endDate': str(params.get('endDate', '')).strip(),
+        'keywords': keywords,
+        'maxPages': int(params.get('maxPages') or 10),
+        'incremental': bool(params.get('incremental', False)),
+        'maxImageBytes': mb_to_bytes(params.get('maxImageMB')),
+        'maxTaskImageBytes': mb_to_bytes(params.get('maxTaskImageMB')),
+        'imageMode': params.get('imageMode') if params.get('imageMode') in REPORT_IMAGE_MODES else 'embed',
+        'reportImageSize': params.get('reportImageSize') if params.get('reportImageSize') in REPORT_IMAGE_SIZES else 'display',
+        'imageQuality': params.get('imageQuality') if params.get('imageQuality') in IMAGE_QUALITIES else 'large',
+    }
+
+
+def scrape_key(params):
+    """规范化参数的摘要，用作合并相同任务的键"""
+    normalized = json.dumps(normalize_scrape_params(params), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def scrape_weibo_web(params, progress_callback=None, package=None, workspace_dir=None):
+    """Web接口调用的爬虫函数
+
+    package: 可选的 LivePackage，传入时压缩包由下载接口流式生成，不再写入磁盘；失败时由调用方 close(error)
+    workspace_dir: 任务工作区（各任务互不覆盖），默认直接写在 weibo_output 下
+    """
     scraper = WebWeiboScraper(
         user_id=params['userId'],
         user_name=params['userName'],
@@ -660,14 +934,27 @@ def scrape_weibo_web(params, progress_callback=None):
         keywords=params.get('keywords', []),
         max_pages=params.get('maxPages', 10),
         request_delay=params.get('requestDelay', 2),
-        output_dir="weibo_output"
+        output_dir="weibo_output",
+        text_concurrency=bounded_int(params.get('textConcurrency'), 4, MAX_WEB_TEXT_CONCURRENCY),
+        image_concurrency=bounded_int(params.get('imageConcurrency'), 6, MAX_WEB_IMAGE_CONCURRENCY),
+        incremental=bool(params.get('incremental', False)),
+        max_image_bytes=mb_to_bytes(params.get('maxImageMB')),
+        max_task_image_bytes=mb_to_bytes(params.get('maxTaskImageMB')),
+        report_image_mode=params.get('imageMode', 'embed'),
+        report_image_size=params.get('reportImageSize', 'display'),
+        image_quality=params.get('imageQuality', 'large'),
+        package=package,
+        workspace_dir=workspace_dir
     )
     
-    # 爬取微博
-    weibos = scraper.scrape_weibos(progress_callback)
-    
-    # 生成报告
-    result = scraper.generate_reports(weibos)
+    try:
+        # 爬取微博
+        weibos = scraper.scrape_weibos(progress_callback)
+        
+        # 生成报告
+        result = scraper.generate_reports(weibos)
+    finally:
+        scraper.image_pool.shutdown()
     
     return result
 